@@ -0,0 +1,63 @@
+import json
+
+#-----------------------------------------------------------------------
+# this file contains the persistence of the StallGuard calibrations.
+#
+# the calibration runs the free motor at the working speed, measures
+# SG_RESULT and picks a threshold with a margin. the result is stored
+# per axis in a JSON file, so the next boot loads it instead of
+# calibrating again. the calibrations are done by the drivers:
+#
+#   tmc.calibrateStallguard("left_hand")            # TMC_2209, SGTHRS
+#   tmc2130.calibrate_stallguard(stepper, "head")   # TMC2130, SGT
+#
+# file format:
+#   {"left_hand": {"driver": "tmc2209", "threshold": 120, ...}, ...}
+#
+# this file does not depend on a driver and can be used on the host.
+#-----------------------------------------------------------------------
+
+CALIBRATION_FILE = "stallguard.json"
+
+#-----------------------------------------------------------------------
+# returns the stored calibration of the axis as dict or None
+#-----------------------------------------------------------------------
+def load_calibration(axis, path=CALIBRATION_FILE):
+    try:
+        with open(path, "r") as f:
+            return json.load(f).get(axis)
+    except (OSError, ValueError):
+        return None
+
+#-----------------------------------------------------------------------
+# stores the calibration of the axis. the other axes in the file
+# are kept
+#-----------------------------------------------------------------------
+def save_calibration(axis, calibration, path=CALIBRATION_FILE):
+    try:
+        with open(path, "r") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        data = {}
+    data[axis] = calibration
+    with open(path, "w") as f:
+        json.dump(data, f)
+
+#-----------------------------------------------------------------------
+# removes the calibration of the axis, the next calibrate measures again
+#-----------------------------------------------------------------------
+def clear_calibration(axis, path=CALIBRATION_FILE):
+    try:
+        with open(path, "r") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return
+    if data.pop(axis, None) is not None:
+        with open(path, "w") as f:
+            json.dump(data, f)
+
+#-----------------------------------------------------------------------
+# returns (min, mean) of the SG_RESULT samples
+#-----------------------------------------------------------------------
+def sg_stats(samples):
+    return min(samples), sum(samples) // len(samples)
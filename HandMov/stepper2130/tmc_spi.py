@@ -1,4 +1,12 @@
 from machine import Pin, SPI
+from stallguard_calibration import load_calibration, save_calibration, sg_stats, CALIBRATION_FILE
+import time
+
+GCONF = 0x00
+COOLCONF = 0x6D
+DRV_STATUS = 0x6F
+
+EN_PWM_MODE = 0x04      # GCONF bit of stealthChop
 
 class TMC2130_SPI:
     def __init__(self, spi_bus=1, cs_pin=5):
@@ -20,10 +28,14 @@ class TMC2130_SPI:
     def init_driver(self):
         """Initialize TMC2130 registers"""
         # Set GCONF register
-        self.write_reg(0x00, 0x00000004)  # Enable stealthChop
+        # keep a copy for calibrate_stallguard
+        self._gconf = 0x00000004
+        self.write_reg(GCONF, self._gconf)  # Enable stealthChop
         
         # Configure COOLCONF for stallGuard
-        self.write_reg(0x6D, 0x00010404)  # stallGuard threshold
+        # COOLCONF is write only, keep a copy for set_sgt
+        self._coolconf = 0x00010404
+        self.write_reg(COOLCONF, self._coolconf)  # stallGuard threshold
         
         # Set IHOLD_IRUN
         self.write_reg(0x10, 0x00001F08)  # Run current and hold current
@@ -51,4 +63,63 @@ class TMC2130_SPI:
     def check_stall(self):
         """Check stallGuard status through SPI"""
         status = self.read_reg(0x41)  # Read DRV_STATUS
-        return (status & 0x01000000) != 0  # Check stallGuard indicator bit
\ No newline at end of file
+        return (status & 0x01000000) != 0  # Check stallGuard indicator bit
+
+    def set_sgt(self, sgt):
+        """Set the StallGuard2 threshold SGT (-64..63) in COOLCONF.
+        Higher values make StallGuard less sensitive."""
+        self._coolconf = (self._coolconf & ~(0x7F << 16)) | ((sgt & 0x7F) << 16)
+        self.write_reg(COOLCONF, self._coolconf)
+
+    def read_sg_result(self):
+        """Read SG_RESULT (0..1023) from DRV_STATUS, 0 means stall"""
+        return self.read_reg(DRV_STATUS) & 0x3FF
+
+    def calibrate_stallguard(self, stepper, axis, interval_us=500, steps=400, every=8,
+                             blank_steps=50, margin=2, sgt_min=-10, sgt_max=63,
+                             force=False, path=CALIBRATION_FILE):
+        """Find the SGT for the free running motor and store it for the axis.
+
+        SGT is raised from sgt_min until SG_RESULT does not reach 0 while
+        the free motor runs "steps" steps with interval_us (the working
+        speed). SG_RESULT is read every "every" steps after blank_steps.
+        The stored SGT is that value plus margin. The motor runs back and
+        forth, one way per SGT value. StallGuard2 does not work in
+        stealthChop, so the sweep runs in spreadCycle and GCONF is
+        restored afterwards. Without force, a stored calibration is
+        loaded instead (see stallguard_calibration.py).
+        """
+        if not force:
+            calibration = load_calibration(axis, path)
+            if calibration is not None and calibration.get("driver") == "tmc2130":
+                self.set_sgt(calibration["sgt"])
+                return calibration
+
+        samples = None
+        direction = 1
+        gconf = self._gconf
+        self.write_reg(GCONF, gconf & ~EN_PWM_MODE)
+        try:
+            for sgt in range(sgt_min, sgt_max + 1):
+                self.set_sgt(sgt)
+                samples = []
+                for i in range(steps):
+                    stepper.single_step(direction)
+                    time.sleep_us(interval_us)
+                    if i >= blank_steps and i % every == 0:
+                        samples.append(self.read_sg_result())
+                direction = 1 - direction
+                if samples and min(samples) > 0:
+                    break
+            else:
+                raise ValueError("StallGuard reads 0 up to SGT " + str(sgt_max))
+        finally:
+            self.write_reg(GCONF, gconf)
+
+        sg_min, sg_mean = sg_stats(samples)
+        sgt = min(sgt + margin, sgt_max)
+        calibration = {"driver": "tmc2130", "sgt": sgt, "interval_us": interval_us,
+                       "sg_min": sg_min, "sg_mean": sg_mean, "samples": len(samples)}
+        save_calibration(axis, calibration, path)
+        self.set_sgt(sgt)
+        return calibration
@@ -0,0 +1,44 @@
+import time
+from tmc.TMC_2209_crc import crc8_atm, crc8_atm_bitwise
+
+# run on the device or on the host from the HandMov folder:
+#   python -m tests.crc_benchmark
+
+def now_us():
+    if hasattr(time, "ticks_us"):
+        return time.ticks_us()
+    return int(time.perf_counter() * 1000000)
+
+def elapsed_us(start):
+    if hasattr(time, "ticks_diff"):
+        return time.ticks_diff(time.ticks_us(), start)
+    return now_us() - start
+
+def frames_per_second(crc_func, frame, end, rounds):
+    start = now_us()
+    for _ in range(rounds):
+        crc_func(frame, end)
+    us = elapsed_us(start)
+    return rounds * 1000000 // max(us, 1)
+
+def bitwise(frame, end):
+    return crc8_atm_bitwise(frame[:end])
+
+def table(frame, end):
+    return crc8_atm(frame, 0, end)
+
+def main(rounds=2000):
+    read_frame = bytearray([0x55, 0x00, 0x6C, 0x00])
+    write_frame = bytearray([0x55, 0x00, 0xEC, 0x10, 0x00, 0x00, 0x53, 0x00])
+    reply_frame = bytearray([0x05, 0xFF, 0x6C, 0x10, 0x00, 0x00, 0x53, 0x00])
+
+    for name, frame in (("read", read_frame), ("write", write_frame), ("reply", reply_frame)):
+        end = len(frame) - 1
+        assert bitwise(frame, end) == table(frame, end)
+        old = frames_per_second(bitwise, frame, end, rounds)
+        new = frames_per_second(table, frame, end, rounds)
+        print("CRC8 {} frame: bitwise {} frames/s, table {} frames/s, x{:.1f}".format(
+            name, old, new, new / max(old, 1)))
+
+if __name__ == '__main__':
+    main()
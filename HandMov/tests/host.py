@@ -0,0 +1,156 @@
+import sys
+import time
+import struct
+
+# host simulation for the tests that run without the ESP32.
+# import it before tmc: when there is no machine module (CPython on the
+# host), it installs one with a simulated TMC2209 on the single wire
+# UART, and it adds the MicroPython functions of time.
+# run the host tests from the HandMov folder: python3 -m tests.<name>
+
+def _crc(frame, end):
+    crc = 0
+    for byte in frame[:end]:
+        for _ in range(8):
+            if (crc >> 7) ^ (byte & 1):
+                crc = ((crc << 1) ^ 0x07) & 0xFF
+            else:
+                crc = (crc << 1) & 0xFF
+            byte >>= 1
+    return crc
+
+# simulated TMC2209 behind the UART.
+# every frame is echoed (single wire), read requests are answered
+# from regs, valid writes are stored and counted in IFCNT
+class SimUART:
+
+    def __init__(self, port=None, baudrate=115200, tx=None, rx=None, **kw):
+        self.rx = bytearray()
+        self.regs = {0x00: 0x1C1, 0x6C: 0x10000053, 0x41: 300, 0x6A: 64, 0x6F: 16 << 16}
+        self.ifcnt = 0
+        self.writes = []
+        self.noise = b""    # received after every read reply, e.g. line noise
+
+    def init(self, *args, **kw):
+        pass
+
+    def close(self):
+        pass
+
+    def write(self, buf):
+        buf = bytes(buf)
+        self.rx += buf
+        if len(buf) == 4 and _crc(buf, 3) == buf[3]:
+            reg = buf[2]
+            val = self.ifcnt & 0xFF if reg == 0x02 else self.regs.get(reg, 0)
+            reply = bytearray([0x05, 0xFF, reg]) + struct.pack(">I", val & 0xFFFFFFFF)
+            reply.append(_crc(reply, 7))
+            self.rx += reply + self.noise
+        elif len(buf) == 8 and _crc(buf, 7) == buf[7]:
+            reg = buf[2] & 0x7F
+            self.regs[reg] = struct.unpack(">I", buf[3:7])[0]
+            self.writes.append((reg, self.regs[reg]))
+            self.ifcnt += 1
+        return len(buf)
+
+    def any(self):
+        return len(self.rx)
+
+    def read(self, n=None):
+        if not self.rx:
+            return None
+        n = len(self.rx) if n is None else min(n, len(self.rx))
+        data = bytes(self.rx[:n])
+        del self.rx[:n]
+        return data
+
+    def readinto(self, buf, n=None):
+        if not self.rx:
+            return None
+        n = min(len(buf) if n is None else n, len(self.rx))
+        buf[:n] = self.rx[:n]
+        del self.rx[:n]
+        return n
+
+class SimPin:
+    OUT = 1
+    IN = 0
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_RISING = 1
+    IRQ_FALLING = 2
+
+    def __init__(self, n, mode=None, pull=None):
+        self.n = n
+        self.v = 0
+        self.handler = None
+
+    def __call__(self, v=None):
+        return self.value(v)
+
+    def value(self, v=None):
+        if v is None:
+            return self.v
+        self.v = v
+
+    def on(self):
+        self.v = 1
+
+    def off(self):
+        self.v = 0
+
+    def irq(self, handler=None, trigger=None):
+        self.handler = handler
+
+    # called by the destructor of TMC_2209
+    @staticmethod
+    def cleanup():
+        pass
+
+# the callback is only called by fire(), so the tests decide when
+# the timer runs
+class SimTimer:
+    PERIODIC = 1
+    ONE_SHOT = 0
+
+    def __init__(self, n=0):
+        self.callback = None
+        self.period = None
+
+    def init(self, mode=None, period=None, freq=None, callback=None):
+        self.mode = mode
+        self.period = period
+        self.freq = freq
+        self.callback = callback
+
+    def deinit(self):
+        self.callback = None
+
+    def fire(self):
+        callback = self.callback
+        if self.mode == SimTimer.ONE_SHOT:
+            self.callback = None
+        if callback is not None:
+            callback(self)
+
+if "machine" not in sys.modules:
+    try:
+        import machine
+    except ImportError:
+        machine = type(sys)("machine")
+        machine.UART = SimUART
+        machine.Pin = SimPin
+        machine.Timer = SimTimer
+        sys.modules["machine"] = machine
+
+if not hasattr(time, "ticks_us"):
+    _start = time.perf_counter_ns()
+    time.ticks_us = lambda: ((time.perf_counter_ns() - _start) // 1000) & 0x3FFFFFFF
+    time.ticks_ms = lambda: ((time.perf_counter_ns() - _start) // 1000000) & 0x3FFFFFFF
+    time.ticks_add = lambda a, b: (a + b) & 0x3FFFFFFF
+    def _ticks_diff(a, b):
+        d = (a - b) & 0x3FFFFFFF
+        return d - 0x40000000 if d & 0x20000000 else d
+    time.ticks_diff = _ticks_diff
+    time.sleep_us = lambda us: time.sleep(us / 1000000)
+    time.sleep_ms = lambda ms: time.sleep(ms / 1000)
@@ -0,0 +1,33 @@
+from tmc.TMC_2209_loadmap import LoadMap
+
+# checks LoadMap.minSg for ranges inside, across and outside of the map
+# run on the device or on the host from the HandMov folder:
+#   python -m tests.loadmap_test
+
+def main():
+    loadmap = LoadMap(0, 999, 10)
+    for pos in range(0, 1000, 10):
+        # bin i has the mean SG_RESULT 100 + i
+        loadmap.add(pos, 100 + loadmap.binOf(pos), 10)
+    cases = (
+        ((250, 450), 102),
+        ((450, 250), 102),
+        ((-500, 150), 100),
+        ((850, 5000), 108),
+        ((-500, 5000), 100),
+        ((1000, 5000), None),   # above the map
+        ((-5000, -1), None),    # below the map
+        ((-1, -5000), None),
+    )
+    ok = True
+    for (pos_a, pos_b), expected in cases:
+        result = loadmap.minSg(pos_a, pos_b)
+        passed = result == expected
+        ok = ok and passed
+        print("{} minSg({}, {}) = {}, expected {}".format(
+            "ok  " if passed else "FAIL", pos_a, pos_b, result, expected))
+    print("minSg clamps to the map:", ok)
+    return ok
+
+if __name__ == '__main__':
+    main()
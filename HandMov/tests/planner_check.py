@@ -0,0 +1,64 @@
+from tests import host
+from tmc.TMC_2209_StepperDriver import TMC_2209, RampProfile, MovementAbsRel
+
+# compares TMC_2209.planMove with a simulated run of computeNewSpeed
+# for every ramp profile, without moving the motor.
+# the duration is the time from the first to the last step.
+# the austin, fixed and table plans must match the run, the scurve
+# plan within the rounding of its step intervals
+# run on the device or on the host from the HandMov folder:
+#   python -m tests.planner_check
+
+TOLERANCE = {
+    RampProfile.austin: 0.0001,
+    RampProfile.table: 0.0001,
+    RampProfile.fixed: 0.0001,
+    RampProfile.scurve: 0.005,
+}
+
+def run(tmc, target):
+    # same as runToPositionSteps, but the steps are only counted
+    tmc.setCurrentPosition(0)
+    tmc.prepareMove(target, MovementAbsRel.relative)
+    steps = 0
+    duration = 0
+    while tmc._stepInterval != 0:
+        if steps:
+            duration += tmc._stepInterval
+        steps += 1
+        if tmc._direction == 1:
+            tmc._currentPos += 1
+        else:
+            tmc._currentPos -= 1
+        tmc.computeNewSpeed()
+        if tmc._speed == 0 or tmc.distanceToGo() == 0:
+            break
+    return steps, duration
+
+def compare(tmc, profile, acceleration, maxSpeed, target):
+    tmc.setRampProfile(profile)
+    tmc.setAcceleration(acceleration)
+    tmc.setMaxSpeed(maxSpeed)
+    steps, duration = run(tmc, target)
+    plan = tmc.planMove(target, MovementAbsRel.relative)
+    error = abs(plan["duration_us"] - duration) / duration if duration else 0
+    ok = steps == abs(target) and error <= TOLERANCE[profile] + 1 / max(duration, 1)
+    print("{} profile {} acc {} speed {} steps {}: run {} us, plan {} us ({:.2f}%)".format(
+        "ok  " if ok else "FAIL", profile, acceleration, maxSpeed, target,
+        round(duration), plan["duration_us"], error * 100))
+    return ok
+
+def main():
+    tmc = TMC_2209(4, 3, 2)
+    ok = True
+    # 50, 2000: the ramp is too long for a table
+    for acceleration, maxSpeed in ((500, 200), (2000, 500), (10000, 3000), (50, 2000)):
+        for target in (2, 3, 4, 5, 6, 10, 50, 1000, -400):
+            for profile in TOLERANCE:
+                ok = compare(tmc, profile, acceleration, maxSpeed, target) and ok
+    print("plans match the runs:", ok)
+    tmc.setRampProfile(RampProfile.austin)
+    return ok
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+from tests import host
+from tmc.TMC_2209_StepperDriver import TMC_2209, RampProfile, MovementAbsRel
+
+# compares the ramp profiles of computeNewSpeed without moving the motor.
+# the step intervals of the float (austin) profile are the reference.
+# the duration of a move is the time from the first to the last step.
+# every move must have the same steps. the fixed profile must be within
+# TOLERANCE of the duration of every move.
+# the table profile decelerates with the mirrored acceleration ramp and
+# can not follow the last interval of the austin deceleration, which
+# depends on the fraction of v^2/2a. its moves may differ by up to one
+# c0 (the interval of the first step), that is up to 16% in moves of
+# 3 or 5 steps. from LONG steps on, both profiles must be within
+# TOLERANCE
+# run on the device or on the host from the HandMov folder:
+#   python -m tests.ramp_equivalence
+
+LONG = 400
+TOLERANCE = 0.02
+PROFILES = (RampProfile.fixed, RampProfile.table)
+
+def ramp(tmc, target):
+    # same as runToPositionSteps, but the steps are only counted
+    intervals = []
+    tmc.setCurrentPosition(0)
+    tmc.prepareMove(target, MovementAbsRel.relative)
+    while tmc._stepInterval != 0:
+        intervals.append(int(tmc._stepInterval))
+        if tmc._direction == 1:
+            tmc._currentPos += 1
+        else:
+            tmc._currentPos -= 1
+        tmc.computeNewSpeed()
+        if tmc._speed == 0 or tmc.distanceToGo() == 0:
+            break
+    return intervals
+
+def compare(tmc, profile, acceleration, maxSpeed, target):
+    tmc.setRampProfile(RampProfile.austin)
+    tmc.setAcceleration(acceleration)
+    tmc.setMaxSpeed(maxSpeed)
+    ref = ramp(tmc, target)
+    tmc.setRampProfile(profile)
+    other = ramp(tmc, target)
+    max_diff = 0
+    for i in range(min(len(ref), len(other))):
+        max_diff = max(max_diff, abs(ref[i] - other[i]))
+    duration_ref = sum(ref[1:])
+    duration = sum(other[1:])
+    error = abs(duration - duration_ref) / duration_ref if duration_ref else 0
+    ok = len(ref) == len(other) == abs(target)
+    if profile == RampProfile.table and abs(target) < LONG:
+        ok = ok and abs(duration - duration_ref) <= ref[0]
+    else:
+        ok = ok and error <= TOLERANCE
+    print("{} profile {} acc {} speed {} steps {}: steps {}/{}, duration {}/{} us ({:.1f}%), max interval diff {} us".format(
+        "ok  " if ok else "FAIL", profile, acceleration, maxSpeed, target, len(ref), len(other),
+        duration_ref, duration, error * 100, max_diff))
+    return ok
+
+def main():
+    tmc = TMC_2209(4, 3, 2)
+    ok = True
+    for acceleration, maxSpeed in ((500, 200), (2000, 500), (10000, 3000)):
+        for target in (2, 3, 4, 5, 6, 7, 9, 50, 51, 101, 401, 1000, -400):
+            for profile in PROFILES:
+                ok = compare(tmc, profile, acceleration, maxSpeed, target) and ok
+    print("profiles equivalent:", ok)
+    tmc.setRampProfile(RampProfile.austin)
+    return ok
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+import random
+from tmc.TMC_2209_scurve import SCurvePlan
+
+# checks that the step times of random S-curve plans increase and no
+# interval is shorter than the peak speed allows (no step bursts).
+# also covers jerk >> acceleration, where phase 0 is less than a step.
+# run on the device or on the host from the HandMov folder:
+#   python -m tests.scurve_monotonic
+
+def check(distance, maxSpeed, acceleration, jerk):
+    plan = SCurvePlan(distance, maxSpeed, acceleration, jerk)
+    shortest = int(1000000 / plan.speed) - 1
+    plan.interval(0)
+    last = 0.0
+    for k in range(1, distance):
+        interval = plan.interval(k)
+        if plan._lastTime < last:
+            return "time goes back at step {}".format(k + 1)
+        last = plan._lastTime
+        if interval < shortest:
+            return "interval {} us at step {}, shortest {} us".format(interval, k, shortest)
+    return None
+
+def main(plans=3000):
+    random.seed(1)
+    failed = 0
+    cases = [(1348, 332, 100, 4873)]
+    for _ in range(plans):
+        cases.append((random.randint(2, 3000), random.uniform(10, 3000),
+            random.uniform(10, 20000), random.uniform(10, 200000)))
+    for case in cases:
+        error = check(*case)
+        if error is not None:
+            failed += 1
+            print("distance {} speed {} acceleration {} jerk {}: {}".format(*case, error))
+    print("monotonic plans: {}/{}".format(len(cases) - failed, len(cases)))
+    return failed == 0
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,32 @@
+from tests import host
+from tmc.TMC_2209_uart import TMC_UART
+
+# checks that the echo of a write frame is consumed, so the read after
+# a verified write gets a valid reply on the first try, and that bytes
+# received after a reply do not overwrite it.
+# run on the host from the HandMov folder:
+#   python -m tests.uart_echo_test
+
+def check(name, noise=b"", **mode):
+    uart = TMC_UART(2, 115200, **mode)
+    uart.ser.noise = noise
+    uart.reset_error_counters()
+    ok = uart.write_reg_check(0x10, 0x00071F10)
+    uart.write_reg(0x10, 0x00071F10)
+    value = uart.read_int(0x6C)
+    counters = uart.get_error_counters()
+    errors = sum(v for k, v in counters.items() if k != "ok")
+    print("{}: write ok {}, read {}, {}".format(name, ok, hex(value), counters))
+    return ok and errors == 0 and value == 0x10000053
+
+def main():
+    ok = True
+    ok = check("default") and ok
+    ok = check("zero_alloc", zero_alloc=True) and ok
+    ok = check("exact_framing", exact_framing=True) and ok
+    ok = check("zero_alloc with noise", noise=b"\x00" * 20, zero_alloc=True) and ok
+    print("no reply errors:", ok)
+    return ok
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,9 @@
-from .TMC_2209_uart import TMC_UART
+from .TMC_2209_uart import TMC_UART, TMC_UART_Error
 from . import TMC_2209_reg as reg
+from .TMC_2209_ramp import ramp_cache
+from .TMC_2209_scurve import SCurvePlan
+from . import TMC_2209_planner as planner
+from .TMC_2209_filter import RingBufferFilter
 from machine import Pin as GPIO
 import machine
 import time
@@ -21,6 +25,44 @@ class MovementAbsRel():
     absolute = 0
     relative = 1
 
+class RampProfile():
+    austin = 0      # computeNewSpeed with floats on every step
+    table = 1       # precomputed ramp tables, see TMC_2209_ramp
+    fixed = 2       # computeNewSpeed with integers (fixed point us*2^8)
+    scurve = 3      # jerk limited S-curve, see TMC_2209_scurve
+
+#-----------------------------------------------------------------------
+# CatchUpPolicy
+#
+# how runSpeed schedules the steps after a late step,
+# see setCatchUpPolicy
+#-----------------------------------------------------------------------
+class CatchUpPolicy():
+    rebase = 0      # every step waits the interval from the real time of the last step
+    burst = 1       # absolute deadlines, late steps are made back to back
+    skip = 2        # absolute deadlines, after a step later than one interval the schedule restarts
+    stretch = 3     # absolute deadlines, the delay is made up with steps at most 25% faster
+
+#-----------------------------------------------------------------------
+# ConfigBatch
+#
+# context manager of TMC_2209.configBatch. ok is the result of
+# endConfigBatch
+#-----------------------------------------------------------------------
+class ConfigBatch():
+
+    def __init__(self, tmc):
+        self._tmc = tmc
+        self.ok = None
+
+    def __enter__(self):
+        self._tmc.beginConfigBatch()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.ok = self._tmc.endConfigBatch()
+        return False
+
 #-----------------------------------------------------------------------
 # TMC_2209
 #
@@ -63,7 +105,46 @@ class TMC_2209:
     _cn = 0                         # Last step size in microseconds
     _cmin = 0                       # Min step size in microseconds based on maxSpeed
     _sg_threshold = 100             # threshold for stallguard
+    _shadow = None                  # cached register values (address -> value)
+    _timer = None                   # machine.Timer of startMoveTo
+    _timerDeadline = 0              # ticks_us of the next step of the step timer
+    _timerMinUs = 50                # shortest wait of the step timer, a late step follows after this
+    _timerRunning = False           # whether a move of startMoveTo is running
     _movement_abs_rel = MovementAbsRel.absolute
+    _rampProfile = RampProfile.austin
+    _rampTable = None               # ramp table of the table profile. () if the ramp is too long
+    _rampSpeeds = ()                # speeds of the steps of _rampTable
+    _c0q = 0                        # _c0 in us*2^8 for the fixed profile
+    _cnq = 0                        # _cn in us*2^8 for the fixed profile
+    _cminq = 0                      # _cmin in us*2^8 for the fixed profile
+    _twoa = 2                       # 2*_acceleration as integer for the fixed profile
+    _jerk = 0                       # max jerk of the scurve profile in steps/s^3. 0: 10*_acceleration
+    _scurve = None                  # SCurvePlan of the current move
+    _queue = None                   # absolute targets of queueMove
+    _junctionSteps = 0              # steps to stop from the speed to keep at the target (move queue)
+    _jitter = None                  # JitterRecorder of runSpeed
+    _catchUp = CatchUpPolicy.rebase # step scheduling of runSpeed
+    _lateUs = 100                   # a step more than this late misses its deadline
+    _missedDeadlines = 0            # missed deadlines of the current move
+    _scheduleStart = False          # the next step starts the schedule
+    _lastStepActual = 0             # real time of the last step with deadlines
+    _diagArmed = False              # DIAG interrupt of doHomingDiag is armed
+    _diagFired = False              # DIAG went high while armed
+    _fclk = 12000000                # clock of the TMC in Hz, VACTUAL is in fclk/2^24 steps per second
+    _vactual = 0                    # commanded VACTUAL speed in steps per second (quantized)
+    _vactualTime = 0                # ticks_us of the last VACTUAL change
+    _vactualPos = 0.0               # position integrated from the VACTUAL speed in steps
+    _vactualCorrection = False      # correct the integrated position with MSCNT
+    _mscntRefPos = None             # position at the MSCNT reference
+    _mscntRefSteps = 0              # getMicrostepCounterInSteps at the reference
+    _mscntCheckMs = 0               # period of the MSCNT check after moves. 0: off
+    _mscntCheckLast = 0             # ticks_ms of the last MSCNT check
+    _mscntAutoCorrect = False       # correct _currentPos on a MSCNT mismatch
+    _mscntErrors = 0                # MSCNT mismatches found
+    _loadMap = None                 # LoadMap filled during moves
+    _loadMapMs = 50                 # min time between two load map samples
+    _loadMapMinSpeed = 0            # no load map samples below this speed in steps per second
+    _loadMapLast = 0                # ticks_ms of the last load map sample
     
     def mean(obj, x):
         a = 0
@@ -73,10 +154,14 @@ class TMC_2209:
 
 #-----------------------------------------------------------------------
 # constructor
+# tmc_uart: an already configured TMC_UART, e.g. a node of a
+# TMC_UART_Bus. baudrate and serialport are ignored then
 #-----------------------------------------------------------------------
-    def __init__(self, pin_step, pin_dir, pin_en, baudrate=115200, serialport=2):
+    def __init__(self, pin_step, pin_dir, pin_en, baudrate=115200, serialport=2, tmc_uart=None):
         
-        self.tmc_uart = TMC_UART(serialport, baudrate)
+        if(tmc_uart is None):
+            tmc_uart = TMC_UART(serialport, baudrate)
+        self.tmc_uart = tmc_uart
         self._pin_step = pin_step
         self._pin_dir = pin_dir
         self._pin_en = pin_en
@@ -88,8 +173,11 @@ class TMC_2209:
         self.p_pin_dir(self._direction)
         if(self._loglevel >= Loglevel.info):
             print("TMC2209: GPIO Init finished")      
+        self._shadow = {}
+        self.clearGSTAT()           # refreshes the shadow registers after a driver reset
+        if(not self._shadow):
+            self.refreshShadowRegisters()
         self.readStepsPerRevolution()
-        self.clearGSTAT()
         self.tmc_uart.flushSerialBuffer()
         if(self._loglevel >= Loglevel.info):
             print("TMC2209: Init finished")
@@ -174,6 +262,7 @@ class TMC_2209:
         print("TMC2209: ---")
         print("TMC2209: GENERAL CONFIG")
         gconf = self.tmc_uart.read_int(reg.GCONF)
+        self._shadow[reg.GCONF] = gconf
         if(self._loglevel >= Loglevel.info):
             print("TMC2209:", bin(gconf))
 
@@ -231,14 +320,89 @@ class TMC_2209:
         return gstat
 
 #-----------------------------------------------------------------------
-# read the register Adress "GSTAT" and prints all current setting
+# clears the flags in the register Adress "GSTAT"
+# if the driver was reset, the shadow registers are read again
 #-----------------------------------------------------------------------
     def clearGSTAT(self):        
         gstat = self.tmc_uart.read_int(reg.GSTAT)
+        if(gstat & reg.reset):
+            self.refreshShadowRegisters()
         gstat = self.tmc_uart.set_bit(gstat, reg.reset)
         gstat = self.tmc_uart.set_bit(gstat, reg.drv_err)
         self.tmc_uart.write_reg_check(reg.GSTAT, gstat)
 
+#-----------------------------------------------------------------------
+# reads the config registers GCONF and CHOPCONF into the shadow cache.
+# the write only registers are forgotten, since a reset restores
+# their defaults
+#-----------------------------------------------------------------------
+    def refreshShadowRegisters(self):
+        self._shadow = {}
+        self._shadow[reg.GCONF] = self.tmc_uart.read_int(reg.GCONF)
+        self._shadow[reg.CHOPCONF] = self.tmc_uart.read_int(reg.CHOPCONF)
+        if(self._loglevel >= Loglevel.debug):
+            print("TMC2209: shadow registers refreshed")
+
+#-----------------------------------------------------------------------
+# returns the value of a register from the shadow cache
+# reads it via UART only if it is not cached yet
+#-----------------------------------------------------------------------
+    def readRegShadow(self, addr):
+        val = self._shadow.get(addr)
+        if(val is None):
+            val = self.tmc_uart.read_int(addr)
+            self._shadow[addr] = val
+        return val
+
+#-----------------------------------------------------------------------
+# writes a register through the shadow cache
+# nothing is sent if the cached value is already the same
+# returns whether the value is in the register
+#-----------------------------------------------------------------------
+    def writeRegShadow(self, addr, val):
+        if(self._shadow.get(addr) == val):
+            return True
+        if(self.tmc_uart.write_reg_check(addr, val)):
+            self._shadow[addr] = val
+            return True
+        self._shadow.pop(addr, None)
+        return False
+
+#-----------------------------------------------------------------------
+# starts a batch of config writes. the setters called until
+# endConfigBatch are verified together with one IFCNT delta,
+# e.g. clearGSTAT, setCurrent and setMicrosteppingResolution at init.
+# batches can be nested. call endConfigBatch in a finally block or use
+# configBatch, otherwise an exception leaves the batch open and the
+# following writes are not verified
+#-----------------------------------------------------------------------
+    def beginConfigBatch(self):
+        self.tmc_uart.begin_batch()
+
+#-----------------------------------------------------------------------
+# verifies the writes since beginConfigBatch.
+# if they could not be verified, the shadow registers are read again
+# returns whether all writes were successful
+#-----------------------------------------------------------------------
+    def endConfigBatch(self):
+        ok = self.tmc_uart.end_batch()
+        if(not ok):
+            if(self._loglevel >= Loglevel.error):
+                print("TMC2209: config batch failed")
+            self.refreshShadowRegisters()
+        return ok
+
+#-----------------------------------------------------------------------
+# returns a context manager for a config batch. the batch is ended
+# when the block is left, also by an exception:
+#   with tmc.configBatch() as batch:
+#       tmc.setCurrent(800)
+#       tmc.setMicrosteppingResolution(16)
+#   batch.ok
+#-----------------------------------------------------------------------
+    def configBatch(self):
+        return ConfigBatch(self)
+
 #-----------------------------------------------------------------------
 # read the register Adress "IOIN" and prints all current setting
 #-----------------------------------------------------------------------
@@ -278,6 +442,7 @@ class TMC_2209:
         print("TMC2209: ---")
         print("TMC2209: CHOPPER CONTROL")
         chopconf = self.tmc_uart.read_int(reg.CHOPCONF)
+        self._shadow[reg.CHOPCONF] = chopconf
         if(self._loglevel >= Loglevel.info):
             print("TMC2209:", bin(chopconf))
         
@@ -309,7 +474,7 @@ class TMC_2209:
 # homes the motor in the given direction using stallguard
 #-----------------------------------------------------------------------
     def doHoming(self, direction, threshold=None):
-        sg_results = []
+        sg_filter = RingBufferFilter(6)
         
         if(threshold is not None):
             self._sg_threshold = threshold
@@ -340,11 +505,9 @@ class TMC_2209:
             if (self.runSpeed()): #returns true, when a step is made
                 step_counter += 1
                 self.computeNewSpeed()
-                sg_result = self.getStallguard_Result()
-                sg_results.append(sg_result)
-                if(len(sg_results)>20):
-                    sg_result_average = self.mean(sg_results[-6:])
-                    if(sg_result_average < self._sg_threshold):
+                sg_filter.add(self.getStallguard_Result())
+                if(step_counter>20):
+                    if(sg_filter.mean() < self._sg_threshold):
                         break
 
         if(step_counter<self._stepsPerRevolution):
@@ -353,18 +516,161 @@ class TMC_2209:
                 print("TMC2209: Stepcounter: "+str(step_counter))
             if(self._loglevel >= Loglevel.debug):
                 print("TMC2209: Stepcounter: "+str(step_counter))
-                print(sg_results)
-            self._currentPos = 0
+                print(sg_filter.values())
+            self.setCurrentPosition(0)
         else:
             if(self._loglevel >= Loglevel.error):
                 print("TMC2209: homing failed")
             if(self._loglevel >= Loglevel.debug):
                 print("TMC2209: Stepcounter: "+str(step_counter))
-                print(sg_results)
+                print(sg_filter.values())
         
         if(self._loglevel >= Loglevel.info):
             print("TMC2209: ---")
         
+#-----------------------------------------------------------------------
+# homing with the DIAG output of the driver instead of reading
+# SG_RESULT after every step. the driver compares SG_RESULT with
+# 2*SGTHRS itself and raises DIAG on a stall, an interrupt stops the
+# motor. so the motor runs with full homing speed and there is no UART
+# access during the homing.
+# threshold: same meaning as in doHoming, SGTHRS = threshold/2
+# min_speed: StallGuard is only active above this speed in steps per
+# second (TCOOLTHRS). None uses half of the homing speed
+# blank_steps: DIAG is ignored during the first steps of the ramp.
+# the interrupt only sees rising edges, so a DIAG that is already high
+# after them (the axis started against the end stop) is a stall too
+# returns whether the homing was successful
+#-----------------------------------------------------------------------
+    def doHomingDiag(self, direction, pin_diag, threshold=None, min_speed=None, blank_steps=20):
+        if(threshold is not None):
+            self._sg_threshold = threshold
+        if(min_speed is None):
+            min_speed = self._maxSpeedHoming / 2
+
+        if(self._loglevel >= Loglevel.info):
+            print("TMC2209: ---")
+            print("TMC2209: homing with DIAG")
+
+        # TSTEP is the time between 1/256 microsteps in 1/fclk
+        tcoolthrs = int(self._fclk * self._msres / (256 * min_speed))
+        self._diagArmed = False
+        self._diagFired = False
+        p_diag = self.setStallguard_Callback(pin_diag, min(self._sg_threshold // 2, 255),
+            self.onDiag, min(tcoolthrs, 0xFFFFF))
+
+        self.setDirection_pin(direction)
+        self.setSpreadCycle(0)
+
+        if (direction == 1):
+            self._targetPos = self._stepsPerRevolution * 10
+        else:
+            self._targetPos = -self._stepsPerRevolution * 10
+        self._stepInterval = 0
+        self._speed = 0.0
+        self._n = 0
+        self.setAcceleration(self._accelerationHoming)
+        self.setMaxSpeed(self._maxSpeedHoming)
+        self.startSchedule()
+        self.computeNewSpeed()
+
+        step_counter = 0
+        while (step_counter < self._stepsPerRevolution and not self._diagFired):
+            if (self.runSpeed()): #returns true, when a step is made
+                step_counter += 1
+                self.computeNewSpeed()
+                if (step_counter == blank_steps):
+                    self._diagArmed = True
+                    if (p_diag.value()):
+                        self._diagFired = True
+        self._diagArmed = False
+        p_diag.irq(handler=None)
+        self._stepInterval = 0
+        self._speed = 0.0
+        self._n = 0
+
+        if(self._diagFired):
+            if(self._loglevel >= Loglevel.info):
+                print("TMC2209: homing successful")
+                print("TMC2209: Stepcounter: "+str(step_counter))
+            self.setCurrentPosition(0)
+        else:
+            if(self._loglevel >= Loglevel.error):
+                print("TMC2209: homing failed")
+            if(self._loglevel >= Loglevel.debug):
+                print("TMC2209: Stepcounter: "+str(step_counter))
+
+        if(self._loglevel >= Loglevel.info):
+            print("TMC2209: ---")
+        return self._diagFired
+
+#-----------------------------------------------------------------------
+# interrupt handler of the DIAG pin during doHomingDiag
+# should not be called from outside!
+#-----------------------------------------------------------------------
+    def onDiag(self, pin):
+        if(self._diagArmed):
+            self._diagFired = True
+
+#-----------------------------------------------------------------------
+# calibrates the StallGuard threshold and stores it for the axis
+# (see stallguard_calibration). the threshold has the unit of
+# SG_RESULT (doHoming), SGTHRS is the half of it (doHomingDiag).
+# the motor moves "steps" forward at "speed" (None: the homing speed)
+# and back again. the steps are made by the step timer (startMoveTo),
+# so the UART reads do not slow the motor down. SG_RESULT is only
+# sampled at the working speed and after "blank_steps".
+# threshold = lowest free running SG_RESULT * (1 - margin)
+# force: measure even if there is a stored calibration
+# path: calibration file. None: stallguard_calibration.CALIBRATION_FILE
+# returns the calibration dict
+# stallguard_calibration is imported here, so the driver works without it
+#-----------------------------------------------------------------------
+    def calibrateStallguard(self, axis, speed=None, steps=None, blank_steps=50, margin=0.3, force=False, path=None):
+        from stallguard_calibration import load_calibration, save_calibration, sg_stats, CALIBRATION_FILE
+        if(path is None):
+            path = CALIBRATION_FILE
+        if(not force):
+            calibration = load_calibration(axis, path)
+            if(calibration is not None and calibration.get("driver") == "tmc2209"):
+                self._sg_threshold = calibration["threshold"]
+                self.setStallguard_Threshold(min(self._sg_threshold // 2, 255))
+                return calibration
+
+        if(speed is None):
+            speed = self._maxSpeedHoming
+        if(steps is None):
+            steps = self._stepsPerRevolution
+        maxSpeed = self._maxSpeed
+        self.setSpreadCycle(0)          # StallGuard4 needs StealthChop
+        self.setMaxSpeed(speed)
+
+        samples = []
+        start = self._currentPos
+        try:
+            self.startMoveTo(start + steps, MovementAbsRel.absolute)
+            while(self._timerRunning):
+                if(self._currentPos - start > blank_steps and abs(self._speed) >= speed * 0.9):
+                    samples.append(self.getStallguard_Result())
+            self.startMoveTo(start, MovementAbsRel.absolute)
+            self.waitDone()
+        finally:
+            # a UART error must not leave the motor running
+            self.stopTimer()
+            self.setMaxSpeed(maxSpeed)
+
+        if(not samples):
+            raise ValueError("no StallGuard samples at full speed, move more steps")
+        sg_min, sg_mean = sg_stats(samples)
+        self._sg_threshold = int(sg_min * (1 - margin))
+        calibration = {"driver": "tmc2209", "threshold": self._sg_threshold, "speed": speed,
+            "sg_min": sg_min, "sg_mean": sg_mean, "samples": len(samples)}
+        save_calibration(axis, calibration, path)
+        self.setStallguard_Threshold(min(self._sg_threshold // 2, 255))
+        if(self._loglevel >= Loglevel.info):
+            print("TMC2209: StallGuard threshold", self._sg_threshold, "for", axis)
+        return calibration
+
 #-----------------------------------------------------------------------
 # returns the current motor position in microsteps
 #-----------------------------------------------------------------------
@@ -375,6 +681,9 @@ class TMC_2209:
 # overwrites the current motor position in microsteps
 #-----------------------------------------------------------------------
     def setCurrentPosition(self, newPos):
+        if(self._mscntRefPos is not None):
+            # the MSCNT reference moves with the position
+            self._mscntRefPos += newPos - self._currentPos
         self._currentPos = newPos
 
 #-----------------------------------------------------------------------
@@ -401,14 +710,14 @@ class TMC_2209:
 # returns the motor shaft direction: 0 = CCW; 1 = CW
 #-----------------------------------------------------------------------
     def getDirection_reg(self):
-        gconf = self.tmc_uart.read_int(reg.GCONF)
+        gconf = self.readRegShadow(reg.GCONF)
         return (gconf & reg.shaft)
 
 #-----------------------------------------------------------------------
 # sets the motor shaft direction to the given value: 0 = CCW; 1 = CW
 #-----------------------------------------------------------------------
     def setDirection_reg(self, direction):        
-        gconf = self.tmc_uart.read_int(reg.GCONF)
+        gconf = self.readRegShadow(reg.GCONF)
         if(direction):
             if(self._loglevel >= Loglevel.info):
                 print("TMC2209: write inverse motor direction")
@@ -417,20 +726,20 @@ class TMC_2209:
             if(self._loglevel >= Loglevel.info):
                 print("TMC2209: write normal motor direction")
             gconf = self.tmc_uart.clear_bit(gconf, reg.shaft)
-        self.tmc_uart.write_reg_check(reg.GCONF, gconf)
+        self.writeRegShadow(reg.GCONF, gconf)
   
 #-----------------------------------------------------------------------
 # return whether Vref (1) or 5V (0) is used for current scale
 #-----------------------------------------------------------------------
     def getIScaleAnalog(self):
-        gconf = self.tmc_uart.read_int(reg.GCONF)
+        gconf = self.readRegShadow(reg.GCONF)
         return (gconf & reg.i_scale_analog)
 
 #-----------------------------------------------------------------------
 # sets Vref (1) or 5V (0) for current scale
 #-----------------------------------------------------------------------
     def setIScaleAnalog(self,en):        
-        gconf = self.tmc_uart.read_int(reg.GCONF)
+        gconf = self.readRegShadow(reg.GCONF)
         if(en):
             if(self._loglevel >= Loglevel.info):
                 print("TMC2209: activated Vref for current scale")
@@ -439,7 +748,7 @@ class TMC_2209:
             if(self._loglevel >= Loglevel.info):
                 print("TMC2209: activated 5V-out for current scale")
             gconf = self.tmc_uart.clear_bit(gconf, reg.i_scale_analog)
-        self.tmc_uart.write_reg_check(reg.GCONF, gconf)
+        self.writeRegShadow(reg.GCONF, gconf)
 
 #-----------------------------------------------------------------------
 # returns which sense resistor voltage is used for current scaling
@@ -447,7 +756,7 @@ class TMC_2209:
 # 1: High sensitivity, low sense resistor voltage
 #-----------------------------------------------------------------------
     def getVSense(self):
-        chopconf = self.tmc_uart.read_int(reg.CHOPCONF)
+        chopconf = self.readRegShadow(reg.CHOPCONF)
         return (chopconf & reg.vsense)
 
 #-----------------------------------------------------------------------
@@ -456,7 +765,7 @@ class TMC_2209:
 # 1: High sensitivity, low sense resistor voltage
 #-----------------------------------------------------------------------
     def setVSense(self,en):      
-        chopconf = self.tmc_uart.read_int(reg.CHOPCONF)
+        chopconf = self.readRegShadow(reg.CHOPCONF)
         if(en):
             if(self._loglevel >= Loglevel.info):
                 print("TMC2209: activated High sensitivity, low sense resistor voltage")
@@ -465,7 +774,7 @@ class TMC_2209:
             if(self._loglevel >= Loglevel.info):
                 print("TMC2209: activated Low sensitivity, high sense resistor voltage")
             chopconf = self.tmc_uart.clear_bit(chopconf, reg.vsense)
-        self.tmc_uart.write_reg_check(reg.CHOPCONF, chopconf)
+        self.writeRegShadow(reg.CHOPCONF, chopconf)
 
 #-----------------------------------------------------------------------
 # returns which sense resistor voltage is used for current scaling
@@ -473,7 +782,7 @@ class TMC_2209:
 # 1: High sensitivity, low sense resistor voltage
 #-----------------------------------------------------------------------
     def getInternalRSense(self):
-        gconf = self.tmc_uart.read_int(reg.GCONF)
+        gconf = self.readRegShadow(reg.GCONF)
         return (gconf & reg.internal_rsense)
 
 #-----------------------------------------------------------------------
@@ -482,7 +791,7 @@ class TMC_2209:
 # 1: High sensitivity, low sense resistor voltage
 #-----------------------------------------------------------------------
     def setInternalRSense(self,en):        
-        gconf = self.tmc_uart.read_int(reg.GCONF)
+        gconf = self.readRegShadow(reg.GCONF)
         if(en):
             if(self._loglevel >= Loglevel.info):
                 print("TMC2209: activated internal sense resistors.")
@@ -491,7 +800,7 @@ class TMC_2209:
             if(self._loglevel >= Loglevel.info):
                 print("TMC2209: activated operation with external sense resistors")
             gconf = self.tmc_uart.clear_bit(gconf, reg.internal_rsense)
-        self.tmc_uart.write_reg_check(reg.GCONF, gconf)
+        self.writeRegShadow(reg.GCONF, gconf)
 
 #-----------------------------------------------------------------------
 # sets the current scale (CS) for Running and Holding
@@ -499,16 +808,24 @@ class TMC_2209:
 # IHold = 0-31; IRun = 0-31; IHoldDelay = 0-15
 #-----------------------------------------------------------------------
     def setIRun_Ihold(self, IHold, IRun, IHoldDelay):
+        ihold_irun = self.computeIHoldIRun(IHold, IRun, IHoldDelay)
+        if(self._loglevel >= Loglevel.info):
+            print("TMC2209: ihold_irun: ", bin(ihold_irun))
+            #print(bin(ihold_irun))
+            print("TMC2209: writing ihold_irun")
+        self.writeRegShadow(reg.IHOLD_IRUN, ihold_irun)
+
+#-----------------------------------------------------------------------
+# returns the register value of IHOLD_IRUN
+# IHold = 0-31; IRun = 0-31; IHoldDelay = 0-15
+#-----------------------------------------------------------------------
+    def computeIHoldIRun(self, IHold, IRun, IHoldDelay):
         ihold_irun = 0
         
         ihold_irun = ihold_irun | IHold << 0
         ihold_irun = ihold_irun | IRun << 8
         ihold_irun = ihold_irun | IHoldDelay << 16
-        if(self._loglevel >= Loglevel.info):
-            print("TMC2209: ihold_irun: ", bin(ihold_irun))
-            #print(bin(ihold_irun))
-            print("TMC2209: writing ihold_irun")
-        self.tmc_uart.write_reg_check(reg.IHOLD_IRUN, ihold_irun)
+        return ihold_irun
         
 #-----------------------------------------------------------------------
 # sets the current flow for the motor
@@ -516,6 +833,14 @@ class TMC_2209:
 # check whether Vref is actually 1.2V
 #-----------------------------------------------------------------------
     def setCurrent(self, run_current, hold_current_multiplier = 0.5, hold_current_delay = 10, Vref = 1.2):
+        CS_IHold, CS_IRun, hold_current_delay = self.computeCurrentScale(run_current, hold_current_multiplier, hold_current_delay, Vref)
+        self.setIRun_Ihold(CS_IHold, CS_IRun, hold_current_delay)
+
+#-----------------------------------------------------------------------
+# returns the current scales (CS_IHold, CS_IRun, IHoldDelay)
+# for the given run_current in mA
+#-----------------------------------------------------------------------
+    def computeCurrentScale(self, run_current, hold_current_multiplier = 0.5, hold_current_delay = 10, Vref = 1.2):
         CS_IRun = 0
         Rsense = 0.11
         Vfs = 0
@@ -545,20 +870,87 @@ class TMC_2209:
             print("TMC2209: CS_IHold: " + str(CS_IHold))
             print("TMC2209: Delay: " + str(hold_current_delay))
 
-        self.setIRun_Ihold(CS_IHold, CS_IRun, hold_current_delay)
+        return CS_IHold, CS_IRun, hold_current_delay
+
+#-----------------------------------------------------------------------
+# applies a driver configuration given as dict.
+# only the registers whose value differs from the shadow registers
+# are written, all of them in one verified batch.
+# keys (all optional):
+#   current: run current in mA
+#   hold_current_multiplier, hold_current_delay, vref: see setCurrent
+#   microsteps: 1,2,4,8,16,32,64,128,256
+#   spreadcycle: True for SpreadCycle, False for StealthChop
+#   sg_threshold: SGTHRS, see setStallguard_Threshold
+#   tcoolthrs: TCOOLTHRS, see setCoolStep_Threshold
+# returns whether all writes were successful
+#-----------------------------------------------------------------------
+    def applyConfig(self, config):
+        for key in config:
+            if(key not in ("current", "hold_current_multiplier", "hold_current_delay", "vref",
+                           "microsteps", "spreadcycle", "sg_threshold", "tcoolthrs")):
+                raise ValueError("TMC2209: unknown config key " + str(key))
+
+        gconf = self.readRegShadow(reg.GCONF)
+        chopconf = self.readRegShadow(reg.CHOPCONF)
+        target = []
+
+        if("microsteps" in config):
+            msresdezimal = 8 - int(math.log(config["microsteps"], 2))
+            chopconf = chopconf & ~(reg.msres0 | reg.msres1 | reg.msres2 | reg.msres3)
+            chopconf = chopconf | msresdezimal <<24
+            gconf = self.tmc_uart.set_bit(gconf, reg.mstep_reg_select)
+        target.append((reg.CHOPCONF, chopconf))
+
+        if("spreadcycle" in config):
+            if(config["spreadcycle"]):
+                gconf = self.tmc_uart.set_bit(gconf, reg.en_spreadcycle)
+            else:
+                gconf = self.tmc_uart.clear_bit(gconf, reg.en_spreadcycle)
+        target.append((reg.GCONF, gconf))
+
+        if("current" in config):
+            CS_IHold, CS_IRun, hold_current_delay = self.computeCurrentScale(
+                config["current"],
+                config.get("hold_current_multiplier", 0.5),
+                config.get("hold_current_delay", 10),
+                config.get("vref", 1.2))
+            target.append((reg.IHOLD_IRUN, self.computeIHoldIRun(CS_IHold, CS_IRun, hold_current_delay)))
+
+        if("tcoolthrs" in config):
+            target.append((reg.TCOOLTHRS, config["tcoolthrs"]))
+
+        if("sg_threshold" in config):
+            target.append((reg.SGTHRS, config["sg_threshold"]))
+
+        changed = [(addr, val) for addr, val in target if self._shadow.get(addr) != val]
+        if(self._loglevel >= Loglevel.info):
+            print("TMC2209: applyConfig writes " + str(len(changed)) + " registers")
+        if(not changed):
+            return True
+
+        self.beginConfigBatch()
+        try:
+            for addr, val in changed:
+                self.writeRegShadow(addr, val)
+        finally:
+            ok = self.endConfigBatch()
+        if("microsteps" in config):
+            self.readStepsPerRevolution()
+        return ok
 
 #-----------------------------------------------------------------------
 # return whether spreadcycle (1) is active or stealthchop (0)
 #-----------------------------------------------------------------------
     def getSpreadCycle(self):
-        gconf = self.tmc_uart.read_int(reg.GCONF)
+        gconf = self.readRegShadow(reg.GCONF)
         return (gconf & reg.en_spreadcycle)
 
 #-----------------------------------------------------------------------
 # enables spreadcycle (1) or stealthchop (0)
 #-----------------------------------------------------------------------
     def setSpreadCycle(self,en_spread):
-        gconf = self.tmc_uart.read_int(reg.GCONF)
+        gconf = self.readRegShadow(reg.GCONF)
         if(en_spread):
             if(self._loglevel >= Loglevel.info):
                 print("TMC2209: activated Spreadcycle")
@@ -567,13 +959,13 @@ class TMC_2209:
             if(self._loglevel >= Loglevel.info):
                 print("TMC2209: activated Stealthchop")
             gconf = self.tmc_uart.clear_bit(gconf, reg.en_spreadcycle)
-        self.tmc_uart.write_reg_check(reg.GCONF, gconf)
+        self.writeRegShadow(reg.GCONF, gconf)
 
 #-----------------------------------------------------------------------
 # return whether the tmc inbuilt interpolation is active
 #-----------------------------------------------------------------------
     def getInterpolation(self):
-        chopconf = self.tmc_uart.read_int(reg.CHOPCONF)
+        chopconf = self.readRegShadow(reg.CHOPCONF)
         if(chopconf & reg.intpol):
             return True
         else:
@@ -583,7 +975,7 @@ class TMC_2209:
 # enables the tmc inbuilt interpolation of the steps to 256 microsteps
 #-----------------------------------------------------------------------
     def setInterpolation(self, en):
-        chopconf = self.tmc_uart.read_int(reg.CHOPCONF)
+        chopconf = self.readRegShadow(reg.CHOPCONF)
 
         if(en):
             chopconf = self.tmc_uart.set_bit(chopconf, reg.intpol)
@@ -592,13 +984,13 @@ class TMC_2209:
 
         if(self._loglevel >= Loglevel.info):
             print("TMC2209: writing microstep interpolation setting: "+str(en))
-        self.tmc_uart.write_reg_check(reg.CHOPCONF, chopconf)
+        self.writeRegShadow(reg.CHOPCONF, chopconf)
 
 #-----------------------------------------------------------------------
 # returns the current native microstep resolution (1-256)
 #-----------------------------------------------------------------------
     def getMicroSteppingResolution(self):
-        chopconf = self.tmc_uart.read_int(reg.CHOPCONF)
+        chopconf = self.readRegShadow(reg.CHOPCONF)
         msresdezimal = chopconf & (reg.msres0 | reg.msres1 | reg.msres2 | reg.msres3)
         msresdezimal = msresdezimal >> 24
         msresdezimal = 8 - msresdezimal
@@ -609,16 +1001,15 @@ class TMC_2209:
 # sets the current native microstep resolution (1,2,4,8,16,32,64,128,256)
 #-----------------------------------------------------------------------
     def setMicrosteppingResolution(self, msres):      
-        chopconf = self.tmc_uart.read_int(reg.CHOPCONF)
-        chopconf = chopconf & (~reg.msres0 | ~reg.msres1 | ~reg.msres2 | ~reg.msres3) #setting all bits to zero
+        chopconf = self.readRegShadow(reg.CHOPCONF)
+        chopconf = chopconf & ~(reg.msres0 | reg.msres1 | reg.msres2 | reg.msres3) #setting all bits to zero
         msresdezimal = int(math.log(msres, 2))
         msresdezimal = 8 - msresdezimal
-        chopconf = int(chopconf) & int(4043309055)
         chopconf = chopconf | msresdezimal <<24
         
         if(self._loglevel >= Loglevel.info):
             print("TMC2209: writing "+str(msres)+" microstep setting")
-        self.tmc_uart.write_reg_check(reg.CHOPCONF, chopconf)
+        self.writeRegShadow(reg.CHOPCONF, chopconf)
         self.setMStepResolutionRegSelect(True)
         self.readStepsPerRevolution()
         return True
@@ -629,7 +1020,7 @@ class TMC_2209:
 # this method is called by "setMicrosteppingResolution"
 #-----------------------------------------------------------------------
     def setMStepResolutionRegSelect(self, en):                  
-        gconf = self.tmc_uart.read_int(reg.GCONF)
+        gconf = self.readRegShadow(reg.GCONF)
         
         if(en == True):
             gconf = self.tmc_uart.set_bit(gconf, reg.mstep_reg_select)
@@ -638,7 +1029,7 @@ class TMC_2209:
 
         if(self._loglevel >= Loglevel.info):
             print("TMC2209: writing MStep Reg Select: "+str(en))
-        self.tmc_uart.write_reg_check(reg.GCONF, gconf)
+        self.writeRegShadow(reg.GCONF, gconf)
 
 #-----------------------------------------------------------------------
 # returns how many steps are needed for one revolution
@@ -695,7 +1086,7 @@ class TMC_2209:
             print(bin(threshold))
 
             print("TMC2209: writing sgthrs")
-        self.tmc_uart.write_reg_check(reg.SGTHRS, threshold)
+        self.writeRegShadow(reg.SGTHRS, threshold)
 
 #-----------------------------------------------------------------------
 # This  is  the  lower  threshold  velocity  for  switching  
@@ -708,12 +1099,13 @@ class TMC_2209:
             print(bin(threshold))
 
             print("TMC2209: writing tcoolthrs")
-        self.tmc_uart.write_reg_check(reg.TCOOLTHRS, threshold)
+        self.writeRegShadow(reg.TCOOLTHRS, threshold)
 
 #-----------------------------------------------------------------------
 # set a function to call back, when the driver detects a stall 
 # via stallguard
 # high value on the diag pin can also mean a driver error
+# returns the Pin of DIAG
 #-----------------------------------------------------------------------
     def setStallguard_Callback(self, pin_stallguard, threshold, my_callback, min_speed = 2000):
 
@@ -727,6 +1119,7 @@ class TMC_2209:
         #GPIO.add_event_detect(pin_stallguard, GPIO.RISING, callback=my_callback, bouncetime=300) 
         p25 = machine.Pin(pin_stallguard, machine.Pin.IN, machine.Pin.PULL_DOWN)
         p25.irq(trigger=machine.Pin.IRQ_RISING, handler=my_callback)
+        return p25
 #-----------------------------------------------------------------------
 # returns the current Microstep counter.
 # Indicates actual position in the microstep table for CUR_A
@@ -745,6 +1138,222 @@ class TMC_2209:
         step = round(step)
         return step+offset
 
+#-----------------------------------------------------------------------
+# sets the speed of the internal pulse generator in steps per second.
+# the TMC makes the steps itself, the STEP pin is ignored until the
+# speed is set to 0 again. the speed changes at once, use rampVActual
+# for an acceleration.
+# the position is integrated from the commanded speed over time
+#-----------------------------------------------------------------------
+    def setVActual(self, speed):
+        vactual = int(round(speed * 16777216 / self._fclk))
+        vactual = max(-0x7FFFFF, min(0x7FFFFF, vactual))
+        self.updateVActualPosition()
+        if(self._vactual == 0 and vactual != 0):
+            self._vactualPos = self._currentPos
+            if(self._vactualCorrection):
+                self.syncMicrostepReference()
+        if(self._loglevel >= Loglevel.movement):
+            print("TMC2209: vactual", vactual)
+        ok = self.writeRegShadow(reg.VACTUAL, vactual & 0xFFFFFF)
+        # the old speed ran until the write
+        self.updateVActualPosition()
+        if(ok):
+            self._vactual = vactual * self._fclk / 16777216
+        return ok
+
+#-----------------------------------------------------------------------
+# returns the speed of the internal pulse generator in steps per second
+#-----------------------------------------------------------------------
+    def getVActual(self):
+        return self._vactual
+
+#-----------------------------------------------------------------------
+# changes the VACTUAL speed with the given acceleration in steps per
+# second per second (None uses the acceleration of setAcceleration).
+# the ramp is made of "segments" equal speed steps, so it costs only
+# a few UART writes. every segment runs at the middle speed of its part
+# of the ramp, so the ramp takes |speed change| / acceleration and the
+# integrated position is the one of a linear ramp.
+# blocks until the speed is reached
+#-----------------------------------------------------------------------
+    def rampVActual(self, speed, acceleration = None, segments = 8):
+        if(acceleration is None):
+            acceleration = self._acceleration
+        start = self._vactual
+        duration_us = abs(speed - start) / acceleration * 1000000
+        begin = time.ticks_us()
+        for i in range(segments):
+            if(self._stop):
+                return False
+            self.setVActual(start + (speed - start) * (2 * i + 1) / (2 * segments))
+            # absolute deadlines, the UART writes do not stretch the ramp
+            deadline = time.ticks_add(begin, int(duration_us * (i + 1) / segments))
+            wait = time.ticks_diff(deadline, time.ticks_us())
+            if(wait > 0):
+                time.sleep_us(wait)
+        if(self._stop):
+            return False
+        self.setVActual(speed)
+        return True
+
+#-----------------------------------------------------------------------
+# ramps the VACTUAL speed down and gives the motor back to STEP/DIR.
+# the integrated position becomes the current position
+#-----------------------------------------------------------------------
+    def stopVActual(self, acceleration = None, segments = 8):
+        self._stop = False
+        self.rampVActual(0, acceleration, segments)
+        self.setVActual(0)
+        self._currentPos = self.getVActualPosition(self._vactualCorrection)
+
+#-----------------------------------------------------------------------
+# adds the distance since the last VACTUAL change to the position
+# should not be called from outside!
+#-----------------------------------------------------------------------
+    def updateVActualPosition(self):
+        now = time.ticks_us()
+        if(self._vactual != 0):
+            self._vactualPos += self._vactual * time.ticks_diff(now, self._vactualTime) / 1000000
+            self._currentPos = round(self._vactualPos)
+        self._vactualTime = now
+
+#-----------------------------------------------------------------------
+# returns the position of the VACTUAL mode in steps.
+# correct: align the integrated position with MSCNT, which is exact
+# within one electrical period (4 fullsteps). the estimate must not be
+# off by more than 2 fullsteps for that
+#-----------------------------------------------------------------------
+    def getVActualPosition(self, correct = False):
+        self.updateVActualPosition()
+        if(correct and self._mscntRefPos is not None):
+            error = self.getMicrostepError()
+            if(error != 0):
+                if(self._loglevel >= Loglevel.movement):
+                    print("TMC2209: vactual position corrected by", error)
+                self._vactualPos += error
+                self._currentPos += error
+        return self._currentPos
+
+#-----------------------------------------------------------------------
+# enables the MSCNT correction of the VACTUAL position.
+# the reference is taken at standstill, when a VACTUAL move starts
+#-----------------------------------------------------------------------
+    def setVActualCorrection(self, en):
+        self._vactualCorrection = en
+        self._mscntRefPos = None
+
+#-----------------------------------------------------------------------
+# takes the current position and MSCNT as reference of the correction
+# should not be called from outside!
+#-----------------------------------------------------------------------
+    def syncMicrostepReference(self):
+        self._mscntRefSteps = self.getMicrostepCounterInSteps()
+        self._mscntRefPos = self._currentPos
+
+#-----------------------------------------------------------------------
+# returns the difference between the position the driver has (MSCNT)
+# and _currentPos in steps, relative to the last
+# syncMicrostepReference. MSCNT repeats every electrical period
+# (4 fullsteps), so only errors within +-2 fullsteps are seen correctly
+# should not be called from outside!
+#-----------------------------------------------------------------------
+    def getMicrostepError(self):
+        period = 4 * self._msres
+        measured = self.getMicrostepCounterInSteps() - self._mscntRefSteps
+        error = (measured - (self._currentPos - self._mscntRefPos)) % period
+        if(error >= period // 2):
+            error -= period
+        return error
+
+#-----------------------------------------------------------------------
+# compares MSCNT with the microstep position predicted from _currentPos.
+# MSCNT counts the STEP pulses the driver has executed. a mismatch
+# means lost STEP pulses or a reset of the driver, not a stall:
+# when the rotor slips, MSCNT still follows the STEP pulses.
+# the first call (or after setMicrostepCheck) takes the reference.
+# the motor must stand still.
+# autoCorrect: adds the error to _currentPos
+# returns the error in steps
+#-----------------------------------------------------------------------
+    def checkMicrostepCounter(self, autoCorrect = False):
+        self._mscntCheckLast = time.ticks_ms()
+        if(self._mscntRefPos is None):
+            self.syncMicrostepReference()
+            return 0
+        error = self.getMicrostepError()
+        if(error != 0):
+            self._mscntErrors += 1
+            if(self._loglevel >= Loglevel.error):
+                print("TMC2209: MSCNT mismatch, position off by", error, "steps")
+            if(autoCorrect):
+                self._currentPos += error
+        return error
+
+#-----------------------------------------------------------------------
+# checks MSCNT after runToPositionSteps, runQueue and waitDone, at most
+# every period_ms (0 turns the check off). the current position is
+# taken as the reference, so it must be right when this is called
+#-----------------------------------------------------------------------
+    def setMicrostepCheck(self, period_ms, autoCorrect = False):
+        self._mscntCheckMs = period_ms
+        self._mscntAutoCorrect = autoCorrect
+        self._mscntRefPos = None
+        if(period_ms > 0):
+            self.checkMicrostepCounter()
+
+#-----------------------------------------------------------------------
+# returns the number of MSCNT mismatches found
+#-----------------------------------------------------------------------
+    def getMicrostepErrors(self):
+        return self._mscntErrors
+
+#-----------------------------------------------------------------------
+# the throttled check of setMicrostepCheck
+# should not be called from outside!
+#-----------------------------------------------------------------------
+    def pollMicrostepCheck(self):
+        if(self._mscntCheckMs > 0 and time.ticks_diff(time.ticks_ms(), self._mscntCheckLast) >= self._mscntCheckMs):
+            self.checkMicrostepCounter(self._mscntAutoCorrect)
+
+#-----------------------------------------------------------------------
+# sets a LoadMap, that gets SG_RESULT and CS_ACTUAL at the current
+# position during moves (run and waitDone), at most every period_ms.
+# every sample takes two UART reads, which delay the next step in run.
+# SG_RESULT is only valid above TCOOLTHRS, so no samples are taken
+# below min_speed. None stops the recording
+#-----------------------------------------------------------------------
+    def setLoadMap(self, loadmap, period_ms = 50, min_speed = 0):
+        self._loadMap = loadmap
+        self._loadMapMs = period_ms
+        self._loadMapMinSpeed = min_speed
+        self._loadMapLast = time.ticks_ms()
+
+#-----------------------------------------------------------------------
+# returns the LoadMap or None
+#-----------------------------------------------------------------------
+    def getLoadMap(self):
+        return self._loadMap
+
+#-----------------------------------------------------------------------
+# the throttled load map sample of setLoadMap.
+# a failed UART read drops the sample instead of stopping the move
+# should not be called from outside!
+#-----------------------------------------------------------------------
+    def pollLoadMap(self):
+        now = time.ticks_ms()
+        if(time.ticks_diff(now, self._loadMapLast) < self._loadMapMs):
+            return
+        if(self._speed == 0 or abs(self._speed) < self._loadMapMinSpeed):
+            return
+        self._loadMapLast = now
+        try:
+            sg_result = self.getStallguard_Result()
+            cs_actual = (self.tmc_uart.read_int(reg.DRVSTATUS) & reg.cs_actual) >> 16
+        except TMC_UART_Error:
+            return
+        self._loadMap.add(self._currentPos, sg_result, cs_actual)
+
 #-----------------------------------------------------------------------
 # sets the maximum motor speed in steps per second
 #-----------------------------------------------------------------------
@@ -754,9 +1363,17 @@ class TMC_2209:
         if (self._maxSpeed != speed):
             self._maxSpeed = speed
             self._cmin = 1000000.0 / speed
+            self._cminq = int(256000000.0 / speed)
+            self._rampTable = None
+            if (self._rampProfile == RampProfile.table or self._rampProfile == RampProfile.scurve):
+                return
             # Recompute _n from current speed and adjust speed if accelerating or cruising
             if (self._n > 0):
-                self._n = (self._speed * self._speed) / (2.0 * self._acceleration) # Equation 16
+                if (self._rampProfile == RampProfile.fixed):
+                    square = self._speed * self._speed
+                    self._n = ((square // self._twoa) << 8) + ((square % self._twoa) << 8) // self._twoa # Equation 16
+                else:
+                    self._n = (self._speed * self._speed) / (2.0 * self._acceleration) # Equation 16
                 self.computeNewSpeed()
 
 #-----------------------------------------------------------------------
@@ -774,12 +1391,19 @@ class TMC_2209:
         if (acceleration < 0.0):
           acceleration = -acceleration
         if (self._acceleration != acceleration):
-            # Recompute _n per Equation 17
-            self._n = self._n * (self._acceleration / acceleration)
+            self._rampTable = None
+            if (self._rampProfile == RampProfile.austin):
+                # Recompute _n per Equation 17
+                self._n = self._n * (self._acceleration / acceleration)
+            elif (self._rampProfile == RampProfile.fixed):
+                self._n = int(self._n * self._acceleration / acceleration)
             # New c0 per Equation 7, with correction per Equation 15
             self._c0 = 0.676 * math.sqrt(2.0 / acceleration) * 1000000.0 # Equation 15
+            self._c0q = int(self._c0 * 256)
+            self._twoa = max(int(2 * acceleration), 1)
             self._acceleration = acceleration
-            self.computeNewSpeed()
+            if (self._rampProfile == RampProfile.austin or self._rampProfile == RampProfile.fixed):
+                self.computeNewSpeed()
 
 #-----------------------------------------------------------------------
 # returns the motor acceleration/decceleration in steps per sec per sec
@@ -787,6 +1411,78 @@ class TMC_2209:
     def getAcceleration(self):
         return self._acceleration
 
+#-----------------------------------------------------------------------
+# sets the max jerk of the scurve profile in steps per second^3.
+# the acceleration rises to its max in acceleration/jerk seconds.
+# 0 uses 10 times the acceleration (0.1 s)
+# is used from the next move on
+#-----------------------------------------------------------------------
+    def setJerk(self, jerk):
+        self._jerk = jerk
+
+#-----------------------------------------------------------------------
+# returns the max jerk of the scurve profile in steps per second^3
+#-----------------------------------------------------------------------
+    def getJerk(self):
+        if (self._jerk > 0):
+            return self._jerk
+        return 10.0 * self._acceleration
+
+#-----------------------------------------------------------------------
+# selects how the speed ramp is computed. See the Enum RampProfile
+# should not be changed during a movement
+#-----------------------------------------------------------------------
+    def setRampProfile(self, profile):
+        self._rampProfile = profile
+        self._rampTable = None
+        self._n = 0
+        if (profile == RampProfile.fixed):
+            self._speed = int(self._speed)
+            self._c0q = int(self._c0 * 256)
+            self._cminq = int(self._cmin * 256)
+            self._twoa = max(int(2 * self._acceleration), 1)
+
+#-----------------------------------------------------------------------
+# sets a JitterRecorder, that records the planned and the real interval
+# of every step made by runSpeed. None stops the recording
+#-----------------------------------------------------------------------
+    def setJitterRecorder(self, recorder):
+        self._jitter = recorder
+
+#-----------------------------------------------------------------------
+# returns the JitterRecorder or None
+#-----------------------------------------------------------------------
+    def getJitterRecorder(self):
+        return self._jitter
+
+#-----------------------------------------------------------------------
+# sets how runSpeed schedules the steps. See the Enum CatchUpPolicy.
+# with the deadline policies every step is due at the deadline of the
+# previous step plus the interval, so a late step does not delay the
+# rest of the move. late_us: a step more than this late is counted as
+# missed deadline
+#-----------------------------------------------------------------------
+    def setCatchUpPolicy(self, policy, late_us = None):
+        self._catchUp = policy
+        if(late_us is not None):
+            self._lateUs = late_us
+
+#-----------------------------------------------------------------------
+# returns the number of missed deadlines of the current or last move
+#-----------------------------------------------------------------------
+    def getMissedDeadlines(self):
+        return self._missedDeadlines
+
+#-----------------------------------------------------------------------
+# starts the step schedule of a new move
+# should not be called from outside!
+#-----------------------------------------------------------------------
+    def startSchedule(self):
+        self._missedDeadlines = 0
+        self._scheduleStart = True
+        if(self._jitter is not None):
+            self._jitter.startMove()
+
 #-----------------------------------------------------------------------
 # stop the current movement
 #-----------------------------------------------------------------------
@@ -801,6 +1497,19 @@ class TMC_2209:
 # when the movement was stopped
 #-----------------------------------------------------------------------
     def runToPositionSteps(self, steps, movement_abs_rel = None):
+        self.prepareMove(steps, movement_abs_rel)
+        #print("speed:", self.computeNewSpeed())
+        while (self.run() and not self._stop): #returns false, when target position is reached
+            pass
+        self.pollMicrostepCheck()
+        return not self._stop
+
+#-----------------------------------------------------------------------
+# sets the target position and computes the first step of a move
+# from standstill.
+# should not be called from outside!
+#-----------------------------------------------------------------------
+    def prepareMove(self, steps, movement_abs_rel = None):
         if(movement_abs_rel is not None):
             this_movement_abs_rel = movement_abs_rel
         else:
@@ -813,12 +1522,93 @@ class TMC_2209:
 
         self._stop = False
         self._stepInterval = 0
-        self._speed = 0.0
+        self._speed = 0
         self._n = 0
+        self.startSchedule()
         self.computeNewSpeed()
-        #print("speed:", self.computeNewSpeed())
-        while (self.run() and not self._stop): #returns false, when target position is reached
-            pass
+
+#-----------------------------------------------------------------------
+# starts a move to the given position in the background.
+# the steps are made by the callback of a one shot machine.Timer,
+# that is armed again after every step for the deadline of the next
+# step. the deadlines are absolute, so a late callback shortens the
+# next wait instead of stretching the move.
+# on the ESP32 timer callbacks are scheduled like soft interrupts,
+# the main loop keeps running between the steps.
+# use isRunning, waitDone and stop to follow the move
+#-----------------------------------------------------------------------
+    def startMoveTo(self, steps, movement_abs_rel = None, timer_id = 0):
+        self.stopTimer()
+        self.prepareMove(steps, movement_abs_rel)
+        if(self._stepInterval == 0):
+            return
+        self._timerRunning = True
+        self._timer = machine.Timer(timer_id)
+        self._timerDeadline = time.ticks_add(time.ticks_us(), int(self._stepInterval))
+        self.armTimer()
+
+#-----------------------------------------------------------------------
+# arms the step timer for _timerDeadline
+# should not be called from outside!
+#-----------------------------------------------------------------------
+    def armTimer(self):
+        wait = time.ticks_diff(self._timerDeadline, time.ticks_us())
+        if(wait < self._timerMinUs):
+            wait = self._timerMinUs
+        self._timer.init(mode=machine.Timer.ONE_SHOT, freq=1000000 / wait, callback=self.onTimerTick)
+
+#-----------------------------------------------------------------------
+# callback of the step timer
+# should not be called from outside!
+#-----------------------------------------------------------------------
+    def onTimerTick(self, timer):
+        if(not self._timerRunning):
+            return
+        if(self._stop):
+            self.stopTimer()
+            return
+        if (self._direction == 1): # Clockwise
+            self._currentPos += 1
+        else: # Anticlockwise 
+            self._currentPos -= 1
+        self.makeAStep()
+        self.computeNewSpeed()
+        if(self._speed == 0.0 or self.distanceToGo() == 0):
+            self.stopTimer()
+            return
+        self._timerDeadline = time.ticks_add(self._timerDeadline, int(self._stepInterval))
+        self.armTimer()
+
+#-----------------------------------------------------------------------
+# stops and releases the step timer
+#-----------------------------------------------------------------------
+    def stopTimer(self):
+        self._timerRunning = False
+        if(self._timer is not None):
+            self._timer.deinit()
+            self._timer = None
+
+#-----------------------------------------------------------------------
+# returns whether a move of startMoveTo is running
+#-----------------------------------------------------------------------
+    def isRunning(self):
+        return self._timerRunning
+
+#-----------------------------------------------------------------------
+# blocks until the move of startMoveTo is finished
+# or timeout_ms is over (None waits forever).
+# returns true when the movement is finished normally and false,
+# when the movement was stopped or the timeout is over
+#-----------------------------------------------------------------------
+    def waitDone(self, timeout_ms = None):
+        start = time.ticks_ms()
+        while(self._timerRunning):
+            if(timeout_ms is not None and time.ticks_diff(time.ticks_ms(), start) > timeout_ms):
+                return False
+            if(self._loadMap is not None):
+                self.pollLoadMap()
+            time.sleep_ms(1)
+        self.pollMicrostepCheck()
         return not self._stop
 
 #-----------------------------------------------------------------------
@@ -829,6 +1619,114 @@ class TMC_2209:
     def runToPositionRevolutions(self, revolutions, movement_absolute_relative = None):
         return self.runToPositionSteps(round(revolutions * self._stepsPerRevolution), movement_absolute_relative)
 
+#-----------------------------------------------------------------------
+# returns the plan of a move to the given position with the current
+# speed settings and ramp profile, without moving the motor:
+# duration, peak speed and the phases. See TMC_2209_planner
+#-----------------------------------------------------------------------
+    def planMove(self, steps, movement_abs_rel = None):
+        if(movement_abs_rel is not None):
+            this_movement_abs_rel = movement_abs_rel
+        else:
+            this_movement_abs_rel = self._movement_abs_rel
+        if(this_movement_abs_rel == MovementAbsRel.absolute):
+            steps -= self._currentPos
+        jerk = None
+        if(self._rampProfile == RampProfile.scurve):
+            jerk = self.getJerk()
+        return planner.planMove(steps, self._acceleration, self._maxSpeed, jerk, self._rampProfile)
+
+#-----------------------------------------------------------------------
+# adds a target to the move queue. relative moves are relative to the
+# previous target in the queue. use runQueue to run the moves
+#-----------------------------------------------------------------------
+    def queueMove(self, steps, movement_abs_rel = None):
+        if(movement_abs_rel is not None):
+            this_movement_abs_rel = movement_abs_rel
+        else:
+            this_movement_abs_rel = self._movement_abs_rel
+        if(self._queue is None):
+            self._queue = []
+        if(this_movement_abs_rel == MovementAbsRel.relative):
+            if(self._queue):
+                steps += self._queue[-1]
+            else:
+                steps += self._currentPos
+        self._queue.append(steps)
+
+#-----------------------------------------------------------------------
+# removes all queued moves
+#-----------------------------------------------------------------------
+    def clearQueue(self):
+        self._queue = None
+
+#-----------------------------------------------------------------------
+# runs the motor through all queued targets.
+# the motor stops only at the last target and where it reverses,
+# at the other targets it keeps the speed the look-ahead allows.
+# speed blending needs the austin profile, the other profiles
+# stop at every target.
+# blocks the code until finished or stopped from a different thread!
+# returns true when the movement if finshed normally and false,
+# when the movement was stopped
+#-----------------------------------------------------------------------
+    def runQueue(self):
+        targets = self._queue or []
+        self._queue = None
+        junctions = self.planJunctions(targets)
+        self._stop = False
+        self.startSchedule()
+        self._stepInterval = 0
+        self._speed = 0
+        self._n = 0
+        for i in range(len(targets)):
+            self._targetPos = targets[i]
+            self._junctionSteps = junctions[i]
+            if(self._stepInterval == 0):
+                self.computeNewSpeed()
+            while(not self._stop and self.distanceToGo() != 0 and self._stepInterval):
+                self.run()
+            if(self._stop):
+                break
+            if(junctions[i] == 0):
+                # stop here, like prepareMove does between single moves
+                self._stepInterval = 0
+                self._speed = 0
+                self._n = 0
+        self._junctionSteps = 0
+        self.pollMicrostepCheck()
+        return not self._stop
+
+#-----------------------------------------------------------------------
+# look-ahead over the targets of runQueue.
+# returns for every target the steps to stop from the speed that is
+# kept there (v^2/2a, Equation 16). it is 0 at the last target and
+# where the direction reverses, and limited so that the motor can
+# reach it from the previous target and stop in time after it
+# should not be called from outside!
+#-----------------------------------------------------------------------
+    def planJunctions(self, targets):
+        junctions = [0] * len(targets)
+        if(self._rampProfile != RampProfile.austin):
+            return junctions
+        maxSteps = (self._maxSpeed * self._maxSpeed) / (2.0 * self._acceleration)
+        start = self._currentPos
+        for i in range(len(targets) - 1):
+            a = targets[i] - (targets[i - 1] if i > 0 else start)
+            b = targets[i + 1] - targets[i]
+            if((a > 0 and b > 0) or (a < 0 and b < 0)):
+                junctions[i] = maxSteps
+        # backward pass, stop in time at the following targets
+        for i in range(len(targets) - 2, -1, -1):
+            junctions[i] = min(junctions[i], junctions[i + 1] + abs(targets[i + 1] - targets[i]))
+        # forward pass, reachable from the previous target
+        previous = 0
+        for i in range(len(targets)):
+            distance = abs(targets[i] - (targets[i - 1] if i > 0 else start))
+            junctions[i] = min(junctions[i], previous + distance)
+            previous = junctions[i]
+        return junctions
+
 #-----------------------------------------------------------------------
 # calculates a new speed if a speed was made
 # returns true if the target position is reached
@@ -837,6 +1735,8 @@ class TMC_2209:
     def run(self):
         if (self.runSpeed()): #returns true, when a step is made
             self.computeNewSpeed()
+            if(self._loadMap is not None):
+                self.pollLoadMap()
             #print(self.getStallguard_Result())
             #print(self.getTStep())
         return (self._speed != 0.0 and self.distanceToGo() != 0)
@@ -857,6 +1757,20 @@ class TMC_2209:
 # https://web.archive.org/web/20140705143928/http://fab.cba.mit.edu/classes/MIT/961.09/projects/i0/Stepper_Motor_Speed_Profile.pdf
 #-----------------------------------------------------------------------
     def computeNewSpeed(self):
+        if (self._rampProfile == RampProfile.table):
+            self.computeNewSpeedTable()
+        elif (self._rampProfile == RampProfile.fixed):
+            self.computeNewSpeedFixed()
+        elif (self._rampProfile == RampProfile.scurve):
+            self.computeNewSpeedSCurve()
+        else:
+            self.computeNewSpeedAustin()
+
+#-----------------------------------------------------------------------
+# the float implementation of the Austin profile
+# should not be called from outside!
+#-----------------------------------------------------------------------
+    def computeNewSpeedAustin(self):
         distanceTo = self.distanceToGo() # +ve is clockwise from curent location     
         stepsToStop = (self._speed * self._speed) / (2.0 * self._acceleration) # Equation 16
         if(self._loglevel >= Loglevel.movement):
@@ -876,22 +1790,22 @@ class TMC_2209:
             # Need to go clockwise from here, maybe decelerate now
             if (self._n > 0):
                 # Currently accelerating, need to decel now? Or maybe going the wrong way?
-                if ((stepsToStop >= distanceTo) or self._direction == Direction.CCW):
+                if ((stepsToStop - self._junctionSteps >= distanceTo) or self._direction == Direction.CCW):
                     self._n = -stepsToStop # Start deceleration
             elif (self._n < 0):
                 # Currently decelerating, need to accel again?
-                if ((stepsToStop < distanceTo) and self._direction == Direction.CW):
+                if ((stepsToStop - self._junctionSteps < distanceTo) and self._direction == Direction.CW):
                     self._n = -self._n # Start accceleration
         elif (distanceTo < 0):
             # We are clockwise from the target
             # Need to go anticlockwise from here, maybe decelerate
             if (self._n > 0):
                 # Currently accelerating, need to decel now? Or maybe going the wrong way?
-                if ((stepsToStop >= -distanceTo) or self._direction == Direction.CW):
+                if ((stepsToStop - self._junctionSteps >= -distanceTo) or self._direction == Direction.CW):
                     self._n = -stepsToStop # Start deceleration
             elif (self._n < 0):
                 # Currently decelerating, need to accel again?
-                if ((stepsToStop < -distanceTo) and self._direction == Direction.CCW):
+                if ((stepsToStop - self._junctionSteps < -distanceTo) and self._direction == Direction.CCW):
                     self._n = -self._n # Start accceleration
         # Need to accelerate or decelerate
         if (self._n == 0):
@@ -917,6 +1831,175 @@ class TMC_2209:
         if (self._direction == 0):
             self._speed = -self._speed
 
+#-----------------------------------------------------------------------
+# the Austin profile from a precomputed ramp table (TMC_2209_ramp).
+# _n is the index in the table: it goes up while accelerating,
+# stays at the end of the table while cruising and goes down when
+# the remaining steps are less than the steps needed to stop.
+# like the acceleration, the deceleration ends with table[1]:
+# c0 is only the wait before the first step.
+# the deceleration is the mirrored acceleration. the austin profile
+# ends with a last interval that depends on the fraction of
+# v^2/2a (Equation 13 with n close to 0), so the moves differ by up
+# to one c0: up to 16% in moves of 3 or 5 steps, below 2% from 400
+# steps (see tests/ramp_equivalence.py).
+# the table is looked up once per (acceleration, max speed)
+# should not be called from outside!
+#-----------------------------------------------------------------------
+    def computeNewSpeedTable(self):
+        table = self._rampTable
+        if (table is None):
+            ramp = ramp_cache.get(self._acceleration, self._maxSpeed)
+            if (ramp is None):
+                table = ()
+            else:
+                table, self._rampSpeeds = ramp
+            self._rampTable = table
+        if (not table):
+            # ramp too long for a table
+            self.computeNewSpeedAustin()
+            return
+
+        distanceTo = self.distanceToGo()
+        n = self._n
+        if (n == 0):
+            if (distanceTo == 0):
+                self._stepInterval = 0
+                self._speed = 0.0
+                return
+            # First step from stopped
+            self.p_pin_step.off()
+            if(distanceTo > 0):
+                self.setDirection_pin(1)
+            else:
+                self.setDirection_pin(0)
+            n = 1
+        else:
+            if (self._direction == Direction.CW):
+                remaining = distanceTo
+            else:
+                remaining = -distanceTo
+            if (remaining <= 0):
+                if (distanceTo == 0 and n <= 2):
+                    # We are at the target and its time to stop
+                    self._stepInterval = 0
+                    self._speed = 0.0
+                    self._n = 0
+                    return
+                # going the wrong way, decelerate and turn around
+                n -= 1
+                if (n == 0):
+                    self._n = 0
+                    self.computeNewSpeedTable()
+                    return
+            elif (remaining < n - 1):
+                n -= 1 # decelerate
+            elif (remaining >= n and n < len(table)):
+                n += 1 # accelerate
+            n = min(n, len(table))
+        self._n = n
+        self._stepInterval = table[n - 1]
+        self._speed = self._rampSpeeds[n - 1]
+        if (self._direction == 0):
+            self._speed = -self._speed
+
+#-----------------------------------------------------------------------
+# the scurve profile. the plan of the move is made at the first step,
+# later steps only look up the interval of step _n in it.
+# a new target during the move is not followed, the plan is kept
+# should not be called from outside!
+#-----------------------------------------------------------------------
+    def computeNewSpeedSCurve(self):
+        if (self._n == 0):
+            distanceTo = self.distanceToGo()
+            if (distanceTo == 0):
+                self._stepInterval = 0
+                self._speed = 0.0
+                return
+            self._scurve = SCurvePlan(abs(distanceTo), self._maxSpeed, self._acceleration, self.getJerk())
+            self.p_pin_step.off()
+            if(distanceTo > 0):
+                self.setDirection_pin(1)
+            else:
+                self.setDirection_pin(0)
+        self._stepInterval = self._scurve.interval(self._n)
+        if (self._stepInterval == 0):
+            # We are at the target and its time to stop
+            self._speed = 0.0
+            self._n = 0
+            self._scurve = None
+            return
+        self._n += 1
+        self._speed = 1000000.0 / self._stepInterval
+        if (self._direction == 0):
+            self._speed = -self._speed
+
+#-----------------------------------------------------------------------
+# the Austin profile with integers only.
+# the step size _cnq is in us*2^8, _n in 1/256 steps and _speed in
+# steps per second, so no float is created per step. _n keeps the
+# fraction of v^2/2a where the deceleration starts, like the float
+# profile. all values stay small ints on MicroPython up to about
+# 23000 steps per second and down to about 60 steps per second^2
+# should not be called from outside!
+#-----------------------------------------------------------------------
+    def computeNewSpeedFixed(self):
+        distanceTo = self.distanceToGo() # +ve is clockwise from curent location     
+        if (self._n < 0):
+            # while decelerating, -_n are the steps left of the ramp.
+            # the rounded speed would let the ramp jitter between accel and decel
+            stepsToStop = -self._n
+        else:
+            # Equation 16 in 1/256 steps. split, speed^2 << 8 would not be a small int
+            square = self._speed * self._speed
+            stepsToStop = ((square // self._twoa) << 8) + ((square % self._twoa) << 8) // self._twoa
+        # floor(256*s) >= 256*d is s >= d, the same decision as the float profile
+        distanceToQ = distanceTo << 8
+        if (distanceTo == 0 and stepsToStop <= 256):
+            # We are at the target and its time to stop
+            self._stepInterval = 0
+            self._speed = 0
+            self._n = 0
+            return
+        
+        if (distanceTo > 0):
+            # We are anticlockwise from the target
+            if (self._n > 0):
+                if ((stepsToStop >= distanceToQ) or self._direction == Direction.CCW):
+                    self._n = -stepsToStop # Start deceleration
+            elif (self._n < 0):
+                if ((stepsToStop < distanceToQ) and self._direction == Direction.CW):
+                    self._n = -self._n # Start accceleration
+        elif (distanceTo < 0):
+            # We are clockwise from the target
+            if (self._n > 0):
+                if ((stepsToStop >= -distanceToQ) or self._direction == Direction.CW):
+                    self._n = -stepsToStop # Start deceleration
+            elif (self._n < 0):
+                if ((stepsToStop < -distanceToQ) and self._direction == Direction.CCW):
+                    self._n = -self._n # Start accceleration
+        if (self._n == 0):
+            # First step from stopped
+            self._cnq = self._c0q
+            self.p_pin_step.off()
+            if(distanceTo > 0):
+                self.setDirection_pin(1)
+            else:
+                self.setDirection_pin(0)
+        else:
+            # Subsequent step. Works for accel (n is +_ve) and decel (n is -ve).
+            q = (self._n + 64) >> 2 # (4n+1) * 2^4
+            if (q == 0):
+                q = -16 # n = -1/4 only after an overshoot
+            self._cnq = self._cnq - (self._cnq << 5) // q # Equation 13
+            if (self._cnq < self._cminq):
+                self._cnq = self._cminq
+        self._n += 256
+        self._stepInterval = (self._cnq + 128) >> 8
+        self._speed = 256000000 // self._cnq
+        if (self._direction == 0):
+            self._speed = -self._speed
+
 #-----------------------------------------------------------------------
 # this methods does the actual steps with the current speed
 #-----------------------------------------------------------------------
@@ -926,6 +2009,8 @@ class TMC_2209:
             return False
         
         curtime = time.ticks_us()
+        if (self._catchUp != CatchUpPolicy.rebase):
+            return self.runSpeedDeadline(curtime)
         #print("TMC2209: current time: " + str(curtime))
         #print("TMC2209: last st time: " + str(self._lastStepTime))
         #print("TMC2209: _stepInterval: " + str(self._stepInterval))
@@ -937,21 +2022,57 @@ class TMC_2209:
                 else: # Anticlockwise 
                     self._currentPos -= 1
                 self.makeAStep()
+                if (self._jitter is not None):
+                    self._jitter.record(int(self._stepInterval), time.ticks_diff(curtime, self._lastStepTime))
                 
                 self._lastStepTime = curtime # Caution: does not account for costs in step()
                 return True
         else:
             return False
 
+#-----------------------------------------------------------------------
+# runSpeed with absolute deadlines.
+# _lastStepTime is the deadline of the last step, not its real time
+# should not be called from outside!
+#-----------------------------------------------------------------------
+    def runSpeedDeadline(self, curtime):
+        interval = int(self._stepInterval)
+        if (self._scheduleStart):
+            deadline = curtime
+        else:
+            deadline = time.ticks_add(self._lastStepTime, interval)
+        late = time.ticks_diff(curtime, deadline)
+        if (late < 0 or self._stop):
+            return False
+        if (self._catchUp == CatchUpPolicy.stretch and late > 0 and not self._scheduleStart):
+            # catch up with intervals of at least 75%
+            if (time.ticks_diff(curtime, self._lastStepActual) < interval - (interval >> 2)):
+                return False
+        if (self._direction == 1): # Clockwise
+            self._currentPos += 1
+        else: # Anticlockwise 
+            self._currentPos -= 1
+        self.makeAStep()
+        if (self._jitter is not None):
+            self._jitter.record(interval, time.ticks_diff(curtime, self._lastStepActual))
+        self._scheduleStart = False
+        self._lastStepActual = curtime
+        if (late > self._lateUs):
+            self._missedDeadlines += 1
+        if (self._catchUp == CatchUpPolicy.skip and late >= interval):
+            deadline = curtime
+        self._lastStepTime = deadline
+        return True
+
 #-----------------------------------------------------------------------
 # method that makes on step
 # for the TMC2209 there needs to be a signal duration of minimum 100 ns
 #-----------------------------------------------------------------------
     def makeAStep(self):
         self.p_pin_step.on()
-        time.sleep(1/1000/1000)
+        time.sleep_us(1)
         self.p_pin_step.off()
-        time.sleep(1/1000/1000)
+        time.sleep_us(1)
 
         if(self._loglevel >= Loglevel.movement):
                 print("TMC2209: one step")
@@ -0,0 +1,169 @@
+from .TMC_2209_uart import TMC_UART, TMC_UART_Error
+from machine import UART
+import time
+try:
+    import _thread
+except ImportError:
+    _thread = None
+
+class BusPriority():
+    high = 0
+    normal = 1
+    low = 2
+
+#-----------------------------------------------------------------------
+# TMC_UART_Bus
+#
+# one UART shared by up to 4 TMC2209 on the single wire bus.
+# the drivers are addressed with MS1/MS2 (mtr_id 0-3).
+#
+# every driver gets its own TMC_UART from node(). the bus lock makes
+# sure that only one frame is on the wire at a time, so the nodes can
+# be used directly from different threads.
+#
+# in addition, register accesses can be queued with submit() and poll()
+# and are then executed by service(). the queue picks the request with
+# the highest priority, but every waiting request gains one priority
+# level after "aging" served transactions. so fast stall polling on one
+# axis can not starve config writes on another axis.
+#
+# usage:
+#   bus = TMC_UART_Bus(2)
+#   tmc_a = TMC_2209(4, 3, 2, tmc_uart=bus.node(0))
+#   tmc_b = TMC_2209(10, 9, 8, tmc_uart=bus.node(1))
+#-----------------------------------------------------------------------
+class TMC_UART_Bus:
+
+    ser = None
+    aging = 4                       # served transactions per priority level gained while waiting
+
+#-----------------------------------------------------------------------
+# constructor
+#-----------------------------------------------------------------------
+    def __init__(self, serialport, baudrate=115200, tx=6, rx=7):
+        self.ser = UART(serialport, baudrate=baudrate, tx=tx, rx=rx)
+        self.ser.init(baudrate, bits=8, parity=None, stop=1)
+        self.baudrate = baudrate
+        self._nodes = {}
+        self._queue = []            # [priority, seq, served at submit, node, reg, val, callback, poll]
+        self._polls = []            # [node, reg, period_ms, next_due, callback, priority, pending]
+        self._seq = 0
+        self._served = 0
+        self.errors = 0
+        self._lock = None
+        if _thread is not None:
+            self._lock = _thread.allocate_lock()
+
+#-----------------------------------------------------------------------
+# destructor
+#-----------------------------------------------------------------------
+    def __del__(self):
+        self.ser.close()
+
+#-----------------------------------------------------------------------
+# returns the TMC_UART for the driver with the given address.
+# nodes use exact reply framing, so that a late reply of one driver
+# can never be taken for the reply of another one
+#-----------------------------------------------------------------------
+    def node(self, mtr_id, zero_alloc=False):
+        node = self._nodes.get(mtr_id)
+        if node is None:
+            node = TMC_UART(None, self.baudrate, zero_alloc=zero_alloc, exact_framing=True, mtr_id=mtr_id, bus=self)
+            self._nodes[mtr_id] = node
+        return node
+
+#-----------------------------------------------------------------------
+# locks the bus for one frame
+#-----------------------------------------------------------------------
+    def acquire(self):
+        if self._lock is not None:
+            self._lock.acquire()
+
+    def release(self):
+        if self._lock is not None:
+            self._lock.release()
+
+#-----------------------------------------------------------------------
+# queues a register access.
+# val None reads the register, otherwise val is written with a check.
+# callback(node, reg, result) gets the read value or the result of
+# write_reg_check. result is None, if the read failed
+#-----------------------------------------------------------------------
+    def submit(self, node, reg, val=None, priority=BusPriority.normal, callback=None):
+        self._seq += 1
+        self._queue.append([priority, self._seq, self._served, node, reg, val, callback, None])
+
+#-----------------------------------------------------------------------
+# reads the register every period_ms while service() is called.
+# a poll is queued again only when its last read was served,
+# so a poll can not fill up the queue
+#-----------------------------------------------------------------------
+    def poll(self, node, reg, period_ms, callback, priority=BusPriority.low):
+        self._polls.append([node, reg, period_ms, time.ticks_ms(), callback, priority, False])
+
+#-----------------------------------------------------------------------
+# removes all polls of the register on the node
+#-----------------------------------------------------------------------
+    def stopPoll(self, node, reg):
+        self._polls = [p for p in self._polls if not (p[0] is node and p[1] == reg)]
+
+#-----------------------------------------------------------------------
+# returns the number of queued requests
+#-----------------------------------------------------------------------
+    def pending(self):
+        return len(self._queue)
+
+#-----------------------------------------------------------------------
+# executes up to max_transactions queued requests.
+# returns the number of executed requests
+#-----------------------------------------------------------------------
+    def service(self, max_transactions=1):
+        now = time.ticks_ms()
+        for p in self._polls:
+            if not p[6] and time.ticks_diff(now, p[3]) >= 0:
+                p[3] = time.ticks_add(now, p[2])
+                p[6] = True
+                self._seq += 1
+                self._queue.append([p[5], self._seq, self._served, p[0], p[1], None, p[4], p])
+
+        done = 0
+        while done < max_transactions and self._queue:
+            entry = self._next()
+            self._run(entry)
+            done += 1
+        return done
+
+#-----------------------------------------------------------------------
+# removes and returns the request with the best effective priority
+#-----------------------------------------------------------------------
+    def _next(self):
+        best = 0
+        best_prio = None
+        for i in range(len(self._queue)):
+            e = self._queue[i]
+            prio = e[0] - (self._served - e[2]) // self.aging
+            if best_prio is None or prio < best_prio or (prio == best_prio and e[1] < self._queue[best][1]):
+                best = i
+                best_prio = prio
+        return self._queue.pop(best)
+
+#-----------------------------------------------------------------------
+# executes one request and calls its callback
+#-----------------------------------------------------------------------
+    def _run(self, entry):
+        node = entry[3]
+        reg = entry[4]
+        val = entry[5]
+        try:
+            if val is None:
+                result = node.read_int(reg)
+            else:
+                result = node.write_reg_check(reg, val)
+        except TMC_UART_Error:
+            self.errors += 1
+            result = None
+        self._served += 1
+        if entry[7] is not None:
+            entry[7][6] = False
+        if entry[6] is not None:
+            entry[6](node, reg, result)
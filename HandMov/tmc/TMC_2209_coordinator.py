@@ -0,0 +1,276 @@
+from .TMC_2209_ramp import ramp_cache
+from .TMC_2209_StepperDriver import MovementAbsRel
+import machine
+import math
+import time
+
+#-----------------------------------------------------------------------
+# this file contains the coordinated move of several motors.
+#
+# all axes start and arrive together: the axis with the longest way
+# (leading axis) runs the ramp of the table profile, the other axes
+# are distributed over its steps with a Bresenham/DDA error term.
+# one loop (moveTo) or one machine.Timer (startMoveTo) makes the steps
+# of all axes, so more axes do not make the move take longer.
+#
+# axes can be TMC_2209 and stepper2130.Stepper objects:
+#   coordinator = Coordinator([tmc_a, tmc_b, stepper_c])
+#   coordinator.setMaxSpeed(2000)
+#   coordinator.setAcceleration(5000)
+#   coordinator.moveTo([800, -200, 400])
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+# access to the STEP/DIR pins and the position of a TMC_2209
+#-----------------------------------------------------------------------
+class TMC_2209_Axis:
+
+    def __init__(self, tmc):
+        self.tmc = tmc
+        self.step_pin = tmc.p_pin_step
+
+    def getPosition(self):
+        return self.tmc._currentPos
+
+    def setPosition(self, pos):
+        self.tmc._currentPos = pos
+
+    def setDirection(self, direction):
+        self.tmc.setDirection_pin(direction)
+
+#-----------------------------------------------------------------------
+# access to the STEP/DIR pins and the position of a stepper2130.Stepper
+#-----------------------------------------------------------------------
+class Stepper_Axis:
+
+    def __init__(self, stepper):
+        self.stepper = stepper
+        self.step_pin = stepper.step_pin
+
+    def getPosition(self):
+        return self.stepper.current_position
+
+    def setPosition(self, pos):
+        self.stepper.current_position = pos
+
+    def setDirection(self, direction):
+        self.stepper.dir_pin.value(direction)
+
+#-----------------------------------------------------------------------
+# Coordinator
+#-----------------------------------------------------------------------
+class Coordinator:
+
+    pulse_us = 5                    # STEP pulse width in microseconds (TMC2130 needs more than TMC2209)
+    _maxSpeed = 1.0                 # max speed of the leading axis in steps per second
+    _acceleration = 1.0             # acceleration of the leading axis in steps per second per second
+    _timerMinUs = 50                # shortest wait of the step timer, a late step follows after this
+
+#-----------------------------------------------------------------------
+# constructor
+# axes: list of TMC_2209 or stepper2130.Stepper
+#-----------------------------------------------------------------------
+    def __init__(self, axes):
+        self.axes = [self.makeAxis(a) for a in axes]
+        count = len(self.axes)
+        self._dirs = [0] * count        # +1/-1 per axis
+        self._deltas = [0] * count      # steps per axis, absolute
+        self._errors = [0] * count      # DDA error terms
+        self._lead = 0                  # steps of the leading axis
+        self._k = 0                     # steps of the leading axis made
+        self._table = ()
+        self._stop = False
+        self._running = False
+        self._timer = None
+        self._deadline = 0              # ticks_us of the next step of the step timer
+
+#-----------------------------------------------------------------------
+# returns the adapter of an axis
+# should not be called from outside!
+#-----------------------------------------------------------------------
+    def makeAxis(self, axis):
+        if hasattr(axis, "p_pin_step"):
+            return TMC_2209_Axis(axis)
+        if hasattr(axis, "step_pin"):
+            return Stepper_Axis(axis)
+        # already an adapter
+        return axis
+
+#-----------------------------------------------------------------------
+# sets the max speed of the leading axis in steps per second
+#-----------------------------------------------------------------------
+    def setMaxSpeed(self, speed):
+        self._maxSpeed = speed
+
+#-----------------------------------------------------------------------
+# sets the acceleration of the leading axis in steps per second per second
+#-----------------------------------------------------------------------
+    def setAcceleration(self, acceleration):
+        self._acceleration = acceleration
+
+#-----------------------------------------------------------------------
+# returns the positions of all axes
+#-----------------------------------------------------------------------
+    def getPositions(self):
+        return [a.getPosition() for a in self.axes]
+
+#-----------------------------------------------------------------------
+# computes the steps of all axes and sets the DIR pins.
+# returns the steps of the leading axis
+# should not be called from outside!
+#-----------------------------------------------------------------------
+    def prepareMove(self, targets, movement_abs_rel = MovementAbsRel.absolute):
+        if len(targets) != len(self.axes):
+            raise ValueError("one target per axis needed")
+        lead = 0
+        for i in range(len(self.axes)):
+            axis = self.axes[i]
+            delta = targets[i]
+            if movement_abs_rel == MovementAbsRel.absolute:
+                delta -= axis.getPosition()
+            if delta >= 0:
+                self._dirs[i] = 1
+                axis.setDirection(1)
+            else:
+                self._dirs[i] = -1
+                axis.setDirection(0)
+            self._deltas[i] = abs(delta)
+            lead = max(lead, abs(delta))
+        for i in range(len(self.axes)):
+            self._errors[i] = lead // 2
+        self._lead = lead
+        self._k = 0
+        self._stop = False
+        ramp = ramp_cache.get(self._acceleration, self._maxSpeed)
+        if ramp is None:
+            # the ramp is too long for a table, the speed is limited
+            # to what is reached in ramp_cache.max_len steps (Equation 16)
+            speed = 0.95 * math.sqrt(2.0 * self._acceleration * ramp_cache.max_len)
+            ramp = ramp_cache.get(self._acceleration, speed)
+        self._table = ramp[0]
+        return lead
+
+#-----------------------------------------------------------------------
+# returns the microseconds until the next step of the leading axis.
+# the same table is used for acceleration and deceleration
+# should not be called from outside!
+#-----------------------------------------------------------------------
+    def nextInterval(self):
+        n = min(self._k + 1, self._lead - self._k, len(self._table))
+        return self._table[n - 1]
+
+#-----------------------------------------------------------------------
+# makes one step of the leading axis and the steps the other axes
+# need at this point. returns False after the last step
+# should not be called from outside!
+#-----------------------------------------------------------------------
+    def stepAll(self):
+        lead = self._lead
+        stepped = []
+        for i in range(len(self.axes)):
+            self._errors[i] += self._deltas[i]
+            if self._errors[i] >= lead:
+                self._errors[i] -= lead
+                self.axes[i].step_pin.on()
+                stepped.append(i)
+        time.sleep_us(self.pulse_us)
+        for i in stepped:
+            axis = self.axes[i]
+            axis.step_pin.off()
+            axis.setPosition(axis.getPosition() + self._dirs[i])
+        self._k += 1
+        return self._k < lead
+
+#-----------------------------------------------------------------------
+# moves all axes to the targets. all axes start and stop together.
+# blocks the code until finished or stopped from a different thread!
+# returns true when the movement if finshed normally and false,
+# when the movement was stopped
+#-----------------------------------------------------------------------
+    def moveTo(self, targets, movement_abs_rel = MovementAbsRel.absolute):
+        if self.prepareMove(targets, movement_abs_rel) == 0:
+            return True
+        next_step = time.ticks_us()
+        while not self._stop:
+            while time.ticks_diff(time.ticks_us(), next_step) < 0:
+                pass
+            if not self.stepAll():
+                break
+            next_step = time.ticks_add(next_step, self.nextInterval())
+        return not self._stop
+
+#-----------------------------------------------------------------------
+# starts a coordinated move in the background.
+# the steps are made by the callback of a one shot machine.Timer,
+# that is armed again for the absolute deadline of the next step,
+# like TMC_2209.startMoveTo
+#-----------------------------------------------------------------------
+    def startMoveTo(self, targets, movement_abs_rel = MovementAbsRel.absolute, timer_id = 0):
+        self.stopTimer()
+        if self.prepareMove(targets, movement_abs_rel) == 0:
+            return
+        self._running = True
+        self._timer = machine.Timer(timer_id)
+        self._deadline = time.ticks_us()    # first step right away
+        self.armTimer()
+
+#-----------------------------------------------------------------------
+# arms the step timer for _deadline
+# should not be called from outside!
+#-----------------------------------------------------------------------
+    def armTimer(self):
+        wait = time.ticks_diff(self._deadline, time.ticks_us())
+        if wait < self._timerMinUs:
+            wait = self._timerMinUs
+        self._timer.init(mode=machine.Timer.ONE_SHOT, freq=1000000 / wait, callback=self.onTimerTick)
+
+#-----------------------------------------------------------------------
+# callback of the step timer
+# should not be called from outside!
+#-----------------------------------------------------------------------
+    def onTimerTick(self, timer):
+        if not self._running:
+            return
+        if self._stop:
+            self.stopTimer()
+            return
+        if not self.stepAll():
+            self.stopTimer()
+            return
+        self._deadline = time.ticks_add(self._deadline, self.nextInterval())
+        self.armTimer()
+
+#-----------------------------------------------------------------------
+# stops and releases the step timer
+#-----------------------------------------------------------------------
+    def stopTimer(self):
+        self._running = False
+        if self._timer is not None:
+            self._timer.deinit()
+            self._timer = None
+
+#-----------------------------------------------------------------------
+# stops the current movement
+#-----------------------------------------------------------------------
+    def stop(self):
+        self._stop = True
+
+#-----------------------------------------------------------------------
+# returns whether a move of startMoveTo is running
+#-----------------------------------------------------------------------
+    def isRunning(self):
+        return self._running
+
+#-----------------------------------------------------------------------
+# blocks until the move of startMoveTo is finished
+# or timeout_ms is over (None waits forever).
+# returns true when the movement is finished normally and false,
+# when the movement was stopped or the timeout is over
+#-----------------------------------------------------------------------
+    def waitDone(self, timeout_ms = None):
+        start = time.ticks_ms()
+        while self._running:
+            if timeout_ms is not None and time.ticks_diff(time.ticks_ms(), start) > timeout_ms:
+                return False
+            time.sleep_ms(1)
+        return not self._stop
@@ -0,0 +1,73 @@
+#-----------------------------------------------------------------------
+# TMC_2209_crc
+#
+# table driven CRC8-ATM as used by the TMC2209 UART interface
+# (polynomial x^8 + x^2 + x + 1, bytes are shifted in LSB first).
+#
+# the driver feeds every byte LSB first into an MSB first CRC register.
+# instead of mirroring each byte, the CRC is kept bit reversed while
+# the datagram is processed, so one table lookup per byte is enough:
+#   crc = CRC8_TABLE[crc ^ byte]
+# the result is mirrored back once at the end.
+#
+# this module does not depend on machine, so it can be used and
+# benchmarked on the host as well.
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+# the original bit by bit implementation.
+# kept as reference for the lookup tables and for benchmarks
+#-----------------------------------------------------------------------
+def crc8_atm_bitwise(datagram, initial_value=0):
+    crc = initial_value
+    # Iterate bytes in data
+    for byte in datagram:
+        # Iterate bits in byte
+        for _ in range(0, 8):
+            if (crc >> 7) ^ (byte & 0x01):
+                crc = ((crc << 1) ^ 0x07) & 0xFF
+            else:
+                crc = (crc << 1) & 0xFF
+            # Shift to next bit
+            byte = byte >> 1
+    return crc
+
+#-----------------------------------------------------------------------
+# builds the lookup tables
+# MIRROR_TABLE: bit reversal of a byte
+# CRC8_TABLE: CRC update for one byte in the bit reversed domain
+#-----------------------------------------------------------------------
+def _build_tables():
+    mirror = bytearray(256)
+    for i in range(256):
+        r = 0
+        for bit in range(8):
+            if i & (1 << bit):
+                r |= 0x80 >> bit
+        mirror[i] = r
+    table = bytearray(256)
+    for i in range(256):
+        table[i] = mirror[crc8_atm_bitwise((0,), mirror[i])]
+    return mirror, table
+
+MIRROR_TABLE, CRC8_TABLE = _build_tables()
+
+#-----------------------------------------------------------------------
+# calculates the crc8 over datagram[start:end] without slicing it.
+# datagram can be a list, bytes, bytearray or memoryview
+#-----------------------------------------------------------------------
+def crc8_atm(datagram, start=0, end=None, initial_value=0):
+    if end is None:
+        end = len(datagram)
+    table = CRC8_TABLE
+    crc = MIRROR_TABLE[initial_value]
+    for i in range(start, end):
+        crc = table[crc ^ datagram[i]]
+    return MIRROR_TABLE[crc]
+
+#-----------------------------------------------------------------------
+# returns True if the byte at datagram[end] is the crc8
+# of datagram[start:end]
+#-----------------------------------------------------------------------
+def crc8_atm_check(datagram, start, end):
+    return crc8_atm(datagram, start, end) == datagram[end]
@@ -0,0 +1,29 @@
+#-----------------------------------------------------------------------
+# this file contains the UART errors, shared by TMC_UART and
+# UartTelemetry
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+# result of the reply validation. also the index in error_counters
+#-----------------------------------------------------------------------
+class ReplyError():
+    none = 0
+    short = 1
+    sync = 2
+    address = 3
+    register = 4
+    crc = 5
+
+#-----------------------------------------------------------------------
+# TMC_UART_Error
+#
+# raised by read_int when no valid reply was received
+# within the retry policy
+#-----------------------------------------------------------------------
+class TMC_UART_Error(Exception):
+
+    def __init__(self, reg, error, tries):
+        super().__init__("TMC2209: no valid answer for reg {} after {} tries (error {}). is Stepper Powersupply switched on ?".format(hex(reg), tries, error))
+        self.reg = reg
+        self.error = error
+        self.tries = tries
@@ -0,0 +1,127 @@
+from array import array
+
+#-----------------------------------------------------------------------
+# this file contains filters for integer samples like SG_RESULT,
+# CS_ACTUAL or TSTEP.
+#
+# both filters cost O(1) per sample and do not allocate after the
+# constructor, so they can be used in the step loop:
+#
+#   sg_filter = RingBufferFilter(6)
+#   sg_filter.add(tmc.getStallguard_Result())
+#   if sg_filter.isFull() and sg_filter.mean() < threshold:
+#       ...
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+# RingBufferFilter
+#
+# moving average over the last "size" samples with a running sum
+#-----------------------------------------------------------------------
+class RingBufferFilter:
+
+#-----------------------------------------------------------------------
+# constructor
+#-----------------------------------------------------------------------
+    def __init__(self, size):
+        self.size = size
+        self._values = array('i', bytes(4 * size))
+        self.reset()
+
+#-----------------------------------------------------------------------
+# removes all samples
+#-----------------------------------------------------------------------
+    def reset(self):
+        self._index = 0
+        self._count = 0
+        self.sum = 0
+
+#-----------------------------------------------------------------------
+# adds a sample, the oldest one drops out when the buffer is full
+#-----------------------------------------------------------------------
+    def add(self, value):
+        i = self._index
+        if self._count == self.size:
+            self.sum -= self._values[i]
+        else:
+            self._count += 1
+        self._values[i] = value
+        self.sum += value
+        i += 1
+        if i == self.size:
+            i = 0
+        self._index = i
+
+#-----------------------------------------------------------------------
+# returns the mean of the samples in the buffer (rounded down)
+#-----------------------------------------------------------------------
+    def mean(self):
+        if self._count == 0:
+            return 0
+        return self.sum // self._count
+
+#-----------------------------------------------------------------------
+# returns the number of samples in the buffer
+#-----------------------------------------------------------------------
+    def count(self):
+        return self._count
+
+#-----------------------------------------------------------------------
+# returns whether the buffer holds "size" samples
+#-----------------------------------------------------------------------
+    def isFull(self):
+        return self._count == self.size
+
+#-----------------------------------------------------------------------
+# returns the samples in the buffer as list, the oldest first
+#-----------------------------------------------------------------------
+    def values(self):
+        start = self._index - self._count
+        return [self._values[(start + k) % self.size] for k in range(self._count)]
+
+#-----------------------------------------------------------------------
+# EwmaFilter
+#
+# exponentially weighted moving average with integers:
+# value += (sample - value) / 2^shift
+# the state is kept with "shift" fractional bits, so small changes
+# are not lost
+#-----------------------------------------------------------------------
+class EwmaFilter:
+
+#-----------------------------------------------------------------------
+# constructor
+# shift: 1 follows fast, 4 averages about the last 16 samples
+#-----------------------------------------------------------------------
+    def __init__(self, shift=3):
+        self.shift = shift
+        self.reset()
+
+#-----------------------------------------------------------------------
+# removes all samples
+#-----------------------------------------------------------------------
+    def reset(self):
+        self._acc = 0
+        self._count = 0
+
+#-----------------------------------------------------------------------
+# adds a sample. the first sample sets the value
+#-----------------------------------------------------------------------
+    def add(self, value):
+        if self._count == 0:
+            self._acc = value << self.shift
+        else:
+            self._acc += value - (self._acc >> self.shift)
+        self._count += 1
+
+#-----------------------------------------------------------------------
+# returns the filtered value
+#-----------------------------------------------------------------------
+    def mean(self):
+        return self._acc >> self.shift
+
+#-----------------------------------------------------------------------
+# returns the number of samples since reset
+#-----------------------------------------------------------------------
+    def count(self):
+        return self._count
@@ -0,0 +1,104 @@
+from array import array
+
+#-----------------------------------------------------------------------
+# this file contains the step timing recorder of TMC_2209.
+#
+# runSpeed records the planned interval (_stepInterval) and the real
+# interval since the previous step of every step into a ring buffer.
+# the buffers are preallocated, recording a step does not allocate.
+#
+#   recorder = JitterRecorder(512)
+#   tmc.setJitterRecorder(recorder)
+#   tmc.runToPositionSteps(2000)
+#   print(recorder.summary())
+#
+# jitter is real - planned interval in us. a step is counted as missed,
+# when it was more than late_us too late
+#-----------------------------------------------------------------------
+class JitterRecorder:
+
+#-----------------------------------------------------------------------
+# constructor
+# size: number of steps kept in the ring buffer
+#-----------------------------------------------------------------------
+    def __init__(self, size=256, late_us=100):
+        self.size = size
+        self.late_us = late_us
+        self._planned = array('I', bytes(4 * size))
+        self._actual = array('I', bytes(4 * size))
+        self.reset()
+
+#-----------------------------------------------------------------------
+# removes all samples
+#-----------------------------------------------------------------------
+    def reset(self):
+        self._index = 0
+        self._count = 0             # samples in the buffer
+        self.total = 0              # recorded steps
+        self.missed = 0             # steps later than late_us
+        self.max_us = 0             # max jitter of all recorded steps
+        self._skip = True
+
+#-----------------------------------------------------------------------
+# the next step starts a move, its interval is not recorded
+#-----------------------------------------------------------------------
+    def startMove(self):
+        self._skip = True
+
+#-----------------------------------------------------------------------
+# records one step
+#-----------------------------------------------------------------------
+    def record(self, planned, actual):
+        if self._skip:
+            self._skip = False
+            return
+        i = self._index
+        self._planned[i] = planned
+        self._actual[i] = actual
+        i += 1
+        if i == self.size:
+            i = 0
+        self._index = i
+        if self._count < self.size:
+            self._count += 1
+        self.total += 1
+        jitter = actual - planned
+        if jitter > self.max_us:
+            self.max_us = jitter
+        if jitter > self.late_us:
+            self.missed += 1
+
+#-----------------------------------------------------------------------
+# returns the samples in the buffer as list of (planned, actual),
+# the oldest first
+#-----------------------------------------------------------------------
+    def samples(self):
+        start = self._index - self._count
+        result = []
+        for k in range(self._count):
+            i = (start + k) % self.size
+            result.append((self._planned[i], self._actual[i]))
+        return result
+
+#-----------------------------------------------------------------------
+# returns the stats as dict.
+# mean_us and min_us are over the steps in the buffer,
+# total, missed and max_us over all steps since reset
+#-----------------------------------------------------------------------
+    def summary(self):
+        count = self._count
+        jitter_sum = 0
+        jitter_min = 0
+        for i in range(count):
+            jitter = self._actual[i] - self._planned[i]
+            jitter_sum += jitter
+            if i == 0 or jitter < jitter_min:
+                jitter_min = jitter
+        return {
+            "samples": count,
+            "mean_us": jitter_sum / count if count else 0,
+            "min_us": jitter_min,
+            "max_us": self.max_us,
+            "total": self.total,
+            "missed": self.missed,
+        }
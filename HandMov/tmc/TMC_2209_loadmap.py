@@ -0,0 +1,157 @@
+from array import array
+import struct
+
+#-----------------------------------------------------------------------
+# this file contains the load map of an axis.
+#
+# the travel minPos..maxPos is divided into bins. for every bin the
+# sum of SG_RESULT, the sum of CS_ACTUAL and the number of samples are
+# kept in preallocated arrays, so adding a sample does not allocate.
+# TMC_2209.setLoadMap fills the map during normal moves:
+#
+#   loadmap = LoadMap(0, 20000, 64)
+#   tmc.setLoadMap(loadmap, period_ms=50)
+#   ...moves...
+#   loadmap.save("load_left_hand.bin")
+#   for start, end, sg, cs, count in loadmap.zones(): ...
+#
+# a low SG_RESULT and a high CS_ACTUAL mean a high load.
+# the file is a 16 byte header and the three arrays, for 64 bins
+# 656 bytes
+#-----------------------------------------------------------------------
+
+_MAGIC = b"LMAP"
+_VERSION = 1
+_HEADER = "<4sHHii"                 # magic, version, bins, minPos, maxPos
+
+class LoadMap:
+
+#-----------------------------------------------------------------------
+# constructor
+#-----------------------------------------------------------------------
+    def __init__(self, minPos, maxPos, bins=64):
+        if maxPos <= minPos:
+            raise ValueError("maxPos must be greater than minPos")
+        self.minPos = minPos
+        self.maxPos = maxPos
+        self.bins = bins
+        self._span = maxPos - minPos + 1
+        self._sg = array('I', bytes(4 * bins))     # sum of SG_RESULT
+        self._cs = array('I', bytes(4 * bins))     # sum of CS_ACTUAL
+        self._count = array('H', bytes(2 * bins))  # samples, stops at 65535
+
+#-----------------------------------------------------------------------
+# removes all samples
+#-----------------------------------------------------------------------
+    def reset(self):
+        for i in range(self.bins):
+            self._sg[i] = 0
+            self._cs[i] = 0
+            self._count[i] = 0
+
+#-----------------------------------------------------------------------
+# returns the bin of a position, -1 outside of the map
+#-----------------------------------------------------------------------
+    def binOf(self, pos):
+        if pos < self.minPos or pos > self.maxPos:
+            return -1
+        return (pos - self.minPos) * self.bins // self._span
+
+#-----------------------------------------------------------------------
+# returns the first and the last position of a bin
+#-----------------------------------------------------------------------
+    def binRange(self, i):
+        start = self.minPos + (i * self._span + self.bins - 1) // self.bins
+        end = self.minPos + ((i + 1) * self._span + self.bins - 1) // self.bins - 1
+        return start, end
+
+#-----------------------------------------------------------------------
+# adds a sample at the position. returns False outside of the map
+#-----------------------------------------------------------------------
+    def add(self, pos, sg_result, cs_actual):
+        i = self.binOf(pos)
+        if i < 0 or self._count[i] == 0xFFFF:
+            return False
+        self._sg[i] += sg_result
+        self._cs[i] += cs_actual
+        self._count[i] += 1
+        return True
+
+#-----------------------------------------------------------------------
+# returns the number of samples of a bin
+#-----------------------------------------------------------------------
+    def count(self, i):
+        return self._count[i]
+
+#-----------------------------------------------------------------------
+# returns the mean SG_RESULT of a bin or None without samples
+#-----------------------------------------------------------------------
+    def sgMean(self, i):
+        if self._count[i] == 0:
+            return None
+        return self._sg[i] // self._count[i]
+
+#-----------------------------------------------------------------------
+# returns the mean CS_ACTUAL of a bin or None without samples
+#-----------------------------------------------------------------------
+    def csMean(self, i):
+        if self._count[i] == 0:
+            return None
+        return self._cs[i] // self._count[i]
+
+#-----------------------------------------------------------------------
+# returns the lowest mean SG_RESULT of the bins from pos_a to pos_b,
+# e.g. for the stall threshold of a move. the range is clamped to the
+# map. None without samples or if the range is outside of the map
+#-----------------------------------------------------------------------
+    def minSg(self, pos_a, pos_b):
+        start = max(min(pos_a, pos_b), self.minPos)
+        end = min(max(pos_a, pos_b), self.maxPos)
+        if start > end:
+            return None
+        a = self.binOf(start)
+        b = self.binOf(end)
+        result = None
+        for i in range(a, b + 1):
+            sg = self.sgMean(i)
+            if sg is not None and (result is None or sg < result):
+                result = sg
+        return result
+
+#-----------------------------------------------------------------------
+# returns a list of (first position, last position, mean SG_RESULT,
+# mean CS_ACTUAL, samples) of the bins with samples
+#-----------------------------------------------------------------------
+    def zones(self):
+        result = []
+        for i in range(self.bins):
+            if self._count[i]:
+                start, end = self.binRange(i)
+                result.append((start, end, self.sgMean(i), self.csMean(i), self._count[i]))
+        return result
+
+#-----------------------------------------------------------------------
+# writes the map to a binary file
+#-----------------------------------------------------------------------
+    def save(self, path):
+        with open(path, "wb") as f:
+            f.write(struct.pack(_HEADER, _MAGIC, _VERSION, self.bins, self.minPos, self.maxPos))
+            f.write(self._sg)
+            f.write(self._cs)
+            f.write(self._count)
+
+#-----------------------------------------------------------------------
+# reads a map written by save
+#-----------------------------------------------------------------------
+    @staticmethod
+    def load(path):
+        with open(path, "rb") as f:
+            header = f.read(struct.calcsize(_HEADER))
+            magic, version, bins, minPos, maxPos = struct.unpack(_HEADER, header)
+            if magic != _MAGIC or version != _VERSION:
+                raise ValueError("not a load map file")
+            loadmap = LoadMap(minPos, maxPos, bins)
+            f.readinto(loadmap._sg)
+            f.readinto(loadmap._cs)
+            f.readinto(loadmap._count)
+        return loadmap
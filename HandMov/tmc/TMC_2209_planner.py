@@ -0,0 +1,233 @@
+from .TMC_2209_ramp import ramp_cache
+from .TMC_2209_scurve import SCurvePlan
+import math
+
+#-----------------------------------------------------------------------
+# this file contains the dry run of a move.
+#
+# planMove returns how long a move from standstill to standstill
+# takes, its peak speed and the phases of the ramp, without moving
+# the motor:
+#   plan = planMove(1000, 2000, 500, profile=RampProfile.fixed)
+#   plan["duration_us"], plan["peak_speed"]
+#   for phase in plan["phases"]:
+#       phase["name"], phase["start_us"], phase["end_us"], phase["start_pos"], phase["end_pos"]
+#
+# the time starts with the first step (position 1), so a move of 1
+# step takes 0 us.
+# the austin, fixed and table profiles are planned with the same
+# discrete ramp as TMC_2209.computeNewSpeed, the cruise is summed up
+# at once. the scurve profile uses the times of SCurvePlan
+# (see tests/planner_check.py).
+#
+# this file does not depend on machine and can be used on the host.
+#-----------------------------------------------------------------------
+
+# values of TMC_2209_StepperDriver.RampProfile
+_AUSTIN = 0
+_TABLE = 1
+_FIXED = 2
+_SCURVE = 3
+
+_SCURVE_NAMES = ("jerk up", "accelerate", "jerk down", "cruise", "jerk down", "decelerate", "jerk up")
+
+#-----------------------------------------------------------------------
+# returns the plan of a move of steps (negative for the other direction).
+# profile: a RampProfile value. None plans the scurve profile if jerk
+# is given, otherwise the austin profile
+# jerk: max jerk of the scurve profile. None: 10*acceleration
+#-----------------------------------------------------------------------
+def planMove(steps, acceleration, maxSpeed, jerk = None, profile = None):
+    if profile is None:
+        profile = _AUSTIN if jerk is None else _SCURVE
+    distance = abs(steps)
+    sign = 1 if steps >= 0 else -1
+    if distance <= 1:
+        return _Timeline(distance).result(sign)
+    if profile == _SCURVE:
+        if jerk is None:
+            jerk = 10 * acceleration
+        return _planSCurve(distance, acceleration, maxSpeed, jerk, sign)
+    timeline = _Timeline(distance)
+    if profile == _TABLE:
+        ramp = ramp_cache.get(acceleration, maxSpeed)
+        if ramp is not None:
+            _rampTable(timeline, distance, ramp[0])
+            return timeline.result(sign)
+        # ramp too long for a table, like computeNewSpeedTable
+        profile = _AUSTIN
+    if profile == _FIXED:
+        _rampFixed(timeline, distance, acceleration, maxSpeed)
+    else:
+        _rampAustin(timeline, distance, acceleration, maxSpeed)
+    return timeline.result(sign)
+
+#-----------------------------------------------------------------------
+# the intervals of computeNewSpeedAustin after the steps 1..distance-1
+#-----------------------------------------------------------------------
+def _rampAustin(timeline, distance, acceleration, maxSpeed):
+    cmin = 1000000.0 / maxSpeed
+    cn = 0.676 * math.sqrt(2.0 / acceleration) * 1000000.0 # Equation 15
+    n = 1
+    speed = 1000000.0 / cn
+    k = 1
+    while k < distance:
+        remaining = distance - k
+        stepsToStop = (speed * speed) / (2.0 * acceleration) # Equation 16
+        if n > 0:
+            if stepsToStop >= remaining:
+                n = -stepsToStop
+            elif cn == cmin:
+                # cruising: cmin until the steps to stop reach the remaining
+                # steps. the last one is left to the loop
+                count = math.ceil(remaining - stepsToStop) - 1
+                if count > 0:
+                    timeline.add(cmin, "cruise", count)
+                    n += count
+                    k += count
+                    continue
+        elif n < 0 and stepsToStop < remaining:
+            n = -n
+        phase = "decelerate" if n < 0 else "accelerate"
+        cn = cn - ((2.0 * cn) / ((4.0 * n) + 1)) # Equation 13
+        if cn <= cmin:
+            cn = cmin
+            if n > 0:
+                phase = "cruise"
+        n += 1
+        speed = 1000000.0 / cn
+        timeline.add(cn, phase)
+        k += 1
+
+#-----------------------------------------------------------------------
+# the intervals of computeNewSpeedFixed after the steps 1..distance-1
+#-----------------------------------------------------------------------
+def _rampFixed(timeline, distance, acceleration, maxSpeed):
+    cminq = int(256000000.0 / maxSpeed)
+    twoa = max(int(2 * acceleration), 1)
+    cnq = int(0.676 * math.sqrt(2.0 / acceleration) * 1000000.0 * 256) # Equation 15
+    n = 256
+    speed = 256000000 // cnq
+    k = 1
+    while k < distance:
+        remaining = distance - k
+        if n < 0:
+            stepsToStop = -n
+        else:
+            square = speed * speed
+            stepsToStop = ((square // twoa) << 8) + ((square % twoa) << 8) // twoa # Equation 16
+        if n > 0:
+            if stepsToStop >= remaining << 8:
+                n = -stepsToStop
+            elif cnq == cminq:
+                # cruising, see _rampAustin
+                count = remaining - (stepsToStop >> 8) - 1
+                if count > 0:
+                    timeline.add((cnq + 128) >> 8, "cruise", count)
+                    n += count << 8
+                    k += count
+                    continue
+        elif n < 0 and stepsToStop < remaining << 8:
+            n = -n
+        phase = "decelerate" if n < 0 else "accelerate"
+        q = (n + 64) >> 2
+        if q == 0:
+            q = -16
+        cnq = cnq - (cnq << 5) // q # Equation 13
+        if cnq <= cminq:
+            cnq = cminq
+            if n > 0:
+                phase = "cruise"
+        n += 256
+        speed = 256000000 // cnq
+        timeline.add((cnq + 128) >> 8, phase)
+        k += 1
+
+#-----------------------------------------------------------------------
+# the intervals of computeNewSpeedTable after the steps 1..distance-1
+#-----------------------------------------------------------------------
+def _rampTable(timeline, distance, table):
+    length = len(table)
+    n = 1
+    k = 1
+    while k < distance:
+        remaining = distance - k
+        if remaining < n - 1:
+            n -= 1
+            phase = "decelerate"
+        elif remaining >= n and n < length:
+            n += 1
+            phase = "accelerate" if n < length else "cruise"
+        elif n == length:
+            # cruising until remaining < length - 1, see _rampAustin
+            count = remaining - length + 1
+            if count > 0:
+                timeline.add(table[n - 1], "cruise", count)
+                k += count
+                continue
+            phase = "cruise"
+        else:
+            phase = None # peak of a short move, keeps the phase
+        timeline.add(table[n - 1], phase)
+        k += 1
+
+#-----------------------------------------------------------------------
+# the scurve profile, see TMC_2209_scurve. the time of the first step
+# is the start
+#-----------------------------------------------------------------------
+def _planSCurve(distance, acceleration, maxSpeed, jerk, sign):
+    plan = SCurvePlan(distance, maxSpeed, acceleration, jerk)
+    first = plan.timeAt(1)
+    timeline = _Timeline(distance)
+    timeline.peak = plan.speed
+    timeline.time = (plan.duration - first) * 1000000.0
+    for i in range(7):
+        start = max(plan._t[i] - first, 0.0) * 1000000.0
+        end = max(plan._t[i + 1] - first, 0.0) * 1000000.0
+        timeline.phases.append((_SCURVE_NAMES[i], start, end,
+            max(round(plan._s[i]), 1), max(round(plan._s[i + 1]), 1)))
+    return timeline.result(sign)
+
+#-----------------------------------------------------------------------
+# _Timeline
+#
+# sums up the intervals of a move and groups them into phases
+#-----------------------------------------------------------------------
+class _Timeline:
+
+    def __init__(self, distance):
+        self.distance = distance
+        self.time = 0.0
+        self.pos = 1
+        self.shortest = 0
+        self.peak = 0.0
+        self.phases = []    # (name, start_us, end_us, start_pos, end_pos)
+
+#-----------------------------------------------------------------------
+# adds count steps with the interval. phase None continues the
+# current phase
+#-----------------------------------------------------------------------
+    def add(self, interval, phase, count = 1):
+        start = self.time
+        self.time += interval * count
+        self.pos += count
+        if self.shortest == 0 or interval < self.shortest:
+            self.shortest = interval
+            self.peak = 1000000.0 / interval
+        phases = self.phases
+        if phases and (phase is None or phases[-1][0] == phase):
+            last = phases[-1]
+            phases[-1] = (last[0], last[1], self.time, last[3], self.pos)
+        else:
+            phases.append((phase or "accelerate", start, self.time, self.pos - count, self.pos))
+
+#-----------------------------------------------------------------------
+# returns the result dict. phases without time are left out
+#-----------------------------------------------------------------------
+    def result(self, sign):
+        phases = []
+        for name, start_us, end_us, start_pos, end_pos in self.phases:
+            if end_us > start_us:
+                phases.append({"name": name, "start_us": round(start_us), "end_us": round(end_us),
+                    "start_pos": sign * start_pos, "end_pos": sign * end_pos})
+        return {"duration_us": round(self.time), "peak_speed": self.peak, "phases": phases}
@@ -0,0 +1,135 @@
+from array import array
+import math
+
+#-----------------------------------------------------------------------
+# this file contains precomputed acceleration ramps for the
+# David Austin profile of TMC_2209.computeNewSpeed.
+#
+# the step intervals of the ramp only depend on the acceleration and
+# the max speed. a table holds the interval in microseconds of every
+# step from standstill until the max speed is reached:
+#   table[0] = c0 (Equation 15)
+#   table[n] = table[n-1] - 2*table[n-1]/(4n+1) (Equation 13)
+# clamped to cmin. the deceleration uses the same table backwards.
+# a second table holds the speed in steps per second of every step,
+# so computeNewSpeed does not divide per step.
+#
+# a table of MAX_TABLE_LEN steps takes 24 KB. the cache keeps the
+# tables of 4 (acceleration, maxSpeed) pairs, so several drivers and
+# the Coordinator do not rebuild them on every move. together they
+# hold at most MAX_CACHED_STEPS steps (48 KB), the least recently
+# used tables are evicted first. see ramp_cache.setSize.
+#
+# this file does not depend on machine and can be used on the host.
+#-----------------------------------------------------------------------
+
+MAX_TABLE_LEN = 4096                # longer ramps are not tabled
+MAX_CACHED_STEPS = 2 * MAX_TABLE_LEN  # steps of all cached tables together
+
+#-----------------------------------------------------------------------
+# returns the ramp table as array('I') of step intervals in us,
+# or None if the ramp is longer than max_len steps
+#-----------------------------------------------------------------------
+def build_ramp_table(acceleration, maxSpeed, max_len=MAX_TABLE_LEN):
+    cn = 0.676 * math.sqrt(2.0 / acceleration) * 1000000.0 # Equation 15
+    cmin = 1000000.0 / maxSpeed
+    table = array('I')
+    table.append(round(cn))
+    n = 1
+    while cn > cmin:
+        if n >= max_len:
+            return None
+        cn = cn - ((2.0 * cn) / ((4.0 * n) + 1)) # Equation 13
+        cn = max(cn, cmin)
+        table.append(round(cn))
+        n += 1
+    return table
+
+#-----------------------------------------------------------------------
+# returns the speeds of a ramp table as array('H') in steps per second.
+# at least 1, so a slow step is never taken for standstill
+#-----------------------------------------------------------------------
+def build_speed_table(table):
+    speeds = array('H')
+    for interval in table:
+        speeds.append(max(1, min(round(1000000 / interval), 0xFFFF)))
+    return speeds
+
+#-----------------------------------------------------------------------
+# RampTableCache
+#
+# keeps the ramp tables of the last few (acceleration, maxSpeed) pairs
+# and evicts the least recently used one
+#-----------------------------------------------------------------------
+class RampTableCache:
+
+#-----------------------------------------------------------------------
+# constructor
+# size: number of tables kept
+# max_len: longest ramp in steps that gets a table
+# max_steps: steps of all kept tables together
+#-----------------------------------------------------------------------
+    def __init__(self, size=4, max_len=MAX_TABLE_LEN, max_steps=MAX_CACHED_STEPS):
+        self.size = size
+        self.max_len = max_len
+        self.max_steps = max_steps
+        self._keys = []
+        self._tables = []
+
+#-----------------------------------------------------------------------
+# sets the number of tables kept, the longest tabled ramp and the
+# steps of all kept tables together. the cached tables are removed
+#-----------------------------------------------------------------------
+    def setSize(self, size, max_len=None, max_steps=None):
+        self.size = max(size, 1)
+        if max_len is not None:
+            self.max_len = max_len
+        if max_steps is not None:
+            self.max_steps = max_steps
+        self.clear()
+
+#-----------------------------------------------------------------------
+# returns (intervals, speeds) of the ramp table for the given
+# acceleration and max speed, see build_ramp_table and
+# build_speed_table. None if the ramp is too long for a table
+#-----------------------------------------------------------------------
+    def get(self, acceleration, maxSpeed):
+        keys = self._keys
+        for i in range(len(keys)):
+            key = keys[i]
+            if key[0] == acceleration and key[1] == maxSpeed:
+                table = self._tables[i]
+                if i:
+                    # move to the front
+                    keys.insert(0, keys.pop(i))
+                    self._tables.insert(0, self._tables.pop(i))
+                return table
+        table = build_ramp_table(acceleration, maxSpeed, self.max_len)
+        if table is not None:
+            table = (table, build_speed_table(table))
+        keys.insert(0, (acceleration, maxSpeed))
+        self._tables.insert(0, table)
+        while len(keys) > 1 and (len(keys) > self.size or self.steps() > self.max_steps):
+            keys.pop()
+            self._tables.pop()
+        return table
+
+#-----------------------------------------------------------------------
+# returns the steps of all kept tables
+#-----------------------------------------------------------------------
+    def steps(self):
+        steps = 0
+        for table in self._tables:
+            if table is not None:
+                steps += len(table[0])
+        return steps
+
+#-----------------------------------------------------------------------
+# removes all tables
+#-----------------------------------------------------------------------
+    def clear(self):
+        self._keys = []
+        self._tables = []
+
+# cache shared by all drivers, axes with the same settings share a table
+ramp_cache = RampTableCache()
@@ -16,6 +16,7 @@ IOIN            =   0x06
 IHOLD_IRUN      =   0x10
 TSTEP           =   0x12
 TCOOLTHRS       =   0x14
+VACTUAL         =   0x22
 SGTHRS          =   0x40
 SG_RESULT       =   0x41
 MSCNT           =   0x6A
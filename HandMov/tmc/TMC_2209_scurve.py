@@ -0,0 +1,160 @@
+import math
+
+#-----------------------------------------------------------------------
+# this file contains the jerk limited S-curve profile of TMC_2209.
+#
+# a move from standstill to standstill has up to 7 phases:
+#   0 jerk +j, 1 constant acceleration, 2 jerk -j,
+#   3 constant speed,
+#   4 jerk -j, 5 constant deceleration, 6 jerk +j
+# the acceleration changes linear, so the motor (and the strings on it)
+# is not jerked at the start and the end of the ramps.
+#
+# the phase boundaries are computed once per move. per step only the
+# time of the next step is computed with the polynomial of the current
+# phase, so the cost per step is constant.
+#
+# this file does not depend on machine and can be used on the host.
+#-----------------------------------------------------------------------
+
+_JERK = (1, 0, -1, 0, -1, 0, 1)     # sign of the jerk in each phase
+
+#-----------------------------------------------------------------------
+# SCurvePlan
+#
+# plan = SCurvePlan(distance, maxSpeed, acceleration, jerk)
+# plan.interval(k) returns the microseconds between step k and k+1
+#-----------------------------------------------------------------------
+class SCurvePlan:
+
+#-----------------------------------------------------------------------
+# constructor
+# distance in steps (positive), speeds in steps per second
+#-----------------------------------------------------------------------
+    def __init__(self, distance, maxSpeed, acceleration, jerk):
+        self.distance = distance
+        self.jerk = jerk
+        speed, tj, ta = self.limits(distance, maxSpeed, acceleration, jerk)
+        accel = jerk * tj
+        # distance of a ramp from standstill to speed
+        ramp = speed * (2 * tj + ta) / 2
+        tv = (distance - 2 * ramp) / speed if speed > 0 else 0
+        self.speed = speed
+        self.durations = (tj, ta, tj, max(tv, 0.0), tj, ta, tj)
+
+        # time, position, speed and acceleration at the start of each phase
+        self._t = [0.0] * 8
+        self._s = [0.0] * 8
+        self._v = [0.0] * 8
+        self._a = [0.0] * 8
+        for i in range(7):
+            dt = self.durations[i]
+            j = _JERK[i] * jerk
+            a = self._a[i]
+            v = self._v[i]
+            self._t[i + 1] = self._t[i] + dt
+            self._s[i + 1] = self._s[i] + v * dt + a * dt * dt / 2 + j * dt * dt * dt / 6
+            self._v[i + 1] = v + a * dt + j * dt * dt / 2
+            self._a[i + 1] = a + j * dt
+            if i == 0:
+                self._a[1] = accel # no rounding error in the constant phase
+        self.duration = self._t[7]
+        self._phase = 0
+        self._lastTime = 0.0
+
+#-----------------------------------------------------------------------
+# returns (peak speed, jerk time, constant acceleration time) of a move.
+# the peak speed is lowered, if the distance is too short for maxSpeed
+#-----------------------------------------------------------------------
+    @staticmethod
+    def limits(distance, maxSpeed, acceleration, jerk):
+        speed = maxSpeed
+        if speed * jerk < acceleration * acceleration:
+            # acceleration is not reached
+            tj = math.sqrt(speed / jerk)
+            ta = 0.0
+        else:
+            tj = acceleration / jerk
+            ta = speed / acceleration - tj
+        if speed * (2 * tj + ta) <= distance:
+            return speed, tj, ta
+        # no constant speed phase: distance = speed * (2 * tj + ta)
+        speed = acceleration * (math.sqrt(acceleration * acceleration / (jerk * jerk) + 4 * distance / acceleration) - acceleration / jerk) / 2
+        if speed * jerk >= acceleration * acceleration:
+            tj = acceleration / jerk
+            return speed, tj, speed / acceleration - tj
+        speed = (distance * math.sqrt(jerk) / 2) ** (2 / 3)
+        return speed, math.sqrt(speed / jerk), 0.0
+
+#-----------------------------------------------------------------------
+# returns the time in seconds, when the position is reached.
+# positions must be asked for in increasing order, the time is never
+# before the time of the last step
+#-----------------------------------------------------------------------
+    def timeAt(self, position):
+        if position >= self.distance:
+            return self.duration
+        i = self._phase
+        while i < 6 and position > self._s[i + 1]:
+            i += 1
+        self._phase = i
+        if i == 0:
+            # s = j*t^3/6
+            t = (6 * position / self.jerk) ** (1 / 3)
+        elif i == 6:
+            # same as phase 0 backwards from the end
+            t = self.duration - (6 * (self.distance - position) / self.jerk) ** (1 / 3)
+        else:
+            t = self._t[i] + self.solvePhase(i, position)
+        return max(t, self._lastTime)
+
+#-----------------------------------------------------------------------
+# returns the time after the start of phase i, when the position is
+# reached. Newton from the time of the last step, with bisection when
+# a Newton step leaves the bracket, until the time is within 0.1 us
+# should not be called from outside!
+#-----------------------------------------------------------------------
+    def solvePhase(self, i, position):
+        t0 = self._t[i]
+        s0 = self._s[i]
+        v0 = self._v[i]
+        a0 = self._a[i]
+        j = _JERK[i] * self.jerk
+        lo = max(self._lastTime - t0, 0.0)
+        hi = self.durations[i]
+        if lo > hi:
+            lo = hi
+        dt = lo
+        for _ in range(60):
+            s = s0 + v0 * dt + a0 * dt * dt / 2 + j * dt * dt * dt / 6
+            err = s - position
+            if err < 0:
+                lo = dt
+            else:
+                hi = dt
+            v = v0 + a0 * dt + j * dt * dt / 2
+            if v > 0:
+                step = err / v
+                if -0.0000001 < step < 0.0000001:
+                    break
+                dt -= step
+            if v <= 0 or dt <= lo or dt >= hi:
+                dt = (lo + hi) / 2
+            if hi - lo < 0.0000001:
+                break
+        return dt
+
+#-----------------------------------------------------------------------
+# returns the microseconds between step k and step k+1
+# (k=0: from the start until the first step). 0 after the last step
+#-----------------------------------------------------------------------
+    def interval(self, k):
+        if k >= self.distance:
+            return 0
+        if k == 0:
+            self._phase = 0
+            self._lastTime = 0.0
+        t = self.timeAt(k + 1)
+        dt = t - self._lastTime
+        self._lastTime = t
+        return max(1, round(dt * 1000000))
@@ -0,0 +1,148 @@
+from array import array
+import time
+from .TMC_2209_errors import ReplyError
+
+#-----------------------------------------------------------------------
+# this file contains the UART transaction telemetry of TMC_UART.
+#
+# for every operation (read/write) and register it counts:
+# transactions, bytes on the wire, retries, CRC failures,
+# short replies, other invalid replies (sync, address, register),
+# failed reads and a latency histogram with fixed buckets in ticks_us.
+#
+# the counters of a register are one preallocated array('I'),
+# so recording a transaction does not allocate after the first use.
+# the latency sum is a python int, an array('I') would overflow
+# after 71 minutes of UART traffic
+#-----------------------------------------------------------------------
+
+# upper bounds of the latency buckets in us. the last bucket counts the rest
+LATENCY_BUCKETS_US = (250, 500, 1000, 2000, 4000, 8000, 16000)
+
+class Op():
+    read = 0
+    write = 1
+
+# index of the counters in the array of a register
+TRANSACTIONS    = 0
+BYTES           = 1
+RETRIES         = 2
+CRC_FAILS       = 3
+SHORT_REPLIES   = 4
+INVALID_REPLIES = 5
+FAILURES        = 6
+LATENCY_MAX_US  = 7
+HISTOGRAM       = 8
+
+_COUNTERS = HISTOGRAM + len(LATENCY_BUCKETS_US) + 1
+_NAMES = ("transactions", "bytes", "retries", "crc", "short", "invalid", "failures", "latency_max_us")
+_OP_NAMES = ("read", "write")
+
+#-----------------------------------------------------------------------
+# UartTelemetry
+#-----------------------------------------------------------------------
+class UartTelemetry:
+
+#-----------------------------------------------------------------------
+# constructor
+#-----------------------------------------------------------------------
+    def __init__(self):
+        self.reset()
+
+#-----------------------------------------------------------------------
+# sets all counters to 0
+#-----------------------------------------------------------------------
+    def reset(self):
+        self._regs = {}
+        self._latency_sum = {}      # latency sum in us of the registers
+
+#-----------------------------------------------------------------------
+# returns the counter array of the operation on the register
+#-----------------------------------------------------------------------
+    def _counters(self, op, reg):
+        key = (op << 8) | reg
+        counters = self._regs.get(key)
+        if counters is None:
+            counters = array('I', bytes(4 * _COUNTERS))
+            self._regs[key] = counters
+        return counters
+
+#-----------------------------------------------------------------------
+# records one transaction, started at start_us (time.ticks_us)
+#-----------------------------------------------------------------------
+    def record(self, op, reg, nbytes, start_us):
+        latency = time.ticks_diff(time.ticks_us(), start_us)
+        counters = self._counters(op, reg)
+        counters[TRANSACTIONS] += 1
+        counters[BYTES] += nbytes
+        key = (op << 8) | reg
+        self._latency_sum[key] = self._latency_sum.get(key, 0) + latency
+        if latency > counters[LATENCY_MAX_US]:
+            counters[LATENCY_MAX_US] = latency
+        i = 0
+        for bound in LATENCY_BUCKETS_US:
+            if latency <= bound:
+                break
+            i += 1
+        counters[HISTOGRAM + i] += 1
+
+#-----------------------------------------------------------------------
+# records the result of a reply validation (see ReplyError)
+# sync, address and register errors count as invalid
+#-----------------------------------------------------------------------
+    def record_reply_error(self, reg, err):
+        counters = self._counters(Op.read, reg)
+        if err == ReplyError.short:
+            counters[SHORT_REPLIES] += 1
+        elif err == ReplyError.crc:
+            counters[CRC_FAILS] += 1
+        elif err != ReplyError.none:
+            counters[INVALID_REPLIES] += 1
+
+#-----------------------------------------------------------------------
+# records a retry of a read
+#-----------------------------------------------------------------------
+    def record_retry(self, reg):
+        self._counters(Op.read, reg)[RETRIES] += 1
+
+#-----------------------------------------------------------------------
+# records a read that gave up
+#-----------------------------------------------------------------------
+    def record_failure(self, reg):
+        self._counters(Op.read, reg)[FAILURES] += 1
+
+#-----------------------------------------------------------------------
+# returns all counters as dict:
+# {"read": {reg: {...}}, "write": {reg: {...}}, "total": {"read": {...}, "write": {...}}}
+# every entry has the counters, "histogram" (list, one count per bucket)
+# and "buckets_us" the upper bounds of the buckets
+#-----------------------------------------------------------------------
+    def snapshot(self, reset=False):
+        result = {"read": {}, "write": {}, "total": {}, "buckets_us": LATENCY_BUCKETS_US}
+        totals = [array('I', bytes(4 * _COUNTERS)), array('I', bytes(4 * _COUNTERS))]
+        latency_totals = [0, 0]
+        for key in self._regs:
+            counters = self._regs[key]
+            latency_sum = self._latency_sum.get(key, 0)
+            op = key >> 8
+            result[_OP_NAMES[op]][key & 0xFF] = self._to_dict(counters, latency_sum)
+            latency_totals[op] += latency_sum
+            total = totals[op]
+            for i in range(_COUNTERS):
+                if i == LATENCY_MAX_US:
+                    total[i] = max(total[i], counters[i])
+                else:
+                    total[i] += counters[i]
+        result["total"]["read"] = self._to_dict(totals[Op.read], latency_totals[Op.read])
+        result["total"]["write"] = self._to_dict(totals[Op.write], latency_totals[Op.write])
+        if reset:
+            self.reset()
+        return result
+
+    def _to_dict(self, counters, latency_sum):
+        d = {}
+        for i in range(len(_NAMES)):
+            d[_NAMES[i]] = counters[i]
+        d["latency_sum_us"] = latency_sum
+        d["histogram"] = list(counters[HISTOGRAM:])
+        return d
@@ -4,8 +4,14 @@ import time
 import sys
 import binascii
 import struct
+import gc
 import machine
 from machine import UART
+from .TMC_2209_crc import crc8_atm, crc8_atm_check
+from .TMC_2209_telemetry import UartTelemetry, Op
+from .TMC_2209_errors import ReplyError, TMC_UART_Error
+
+IFCNT           =   0x02
 
 #-----------------------------------------------------------------------
 # TMC_UART
@@ -17,20 +23,62 @@ from machine import UART
 class TMC_UART:
 
     mtr_id=0
+    _batch = None                   # (reg, val) of the writes in the current batch
+    _batch_depth = 0                # nesting level of begin_batch
     ser = None
+    bus = None                      # TMC_UART_Bus, if the UART is shared with other drivers
+    telemetry = None                # UartTelemetry, see enable_telemetry
+    _owns_ser = True
     rFrame  = [0x55, 0, 0, 0  ]
     wFrame  = [0x55, 0, 0, 0 , 0, 0, 0, 0 ]
     communication_pause = 0
+    zero_alloc = False
+    exact_framing = False
+    reply_margin_us = 1000          # slack on top of the wire time for UART FIFO latency
+    retry_tries = 10                # reads per read_int before TMC_UART_Error is raised
+    retry_backoff_us = 500          # pause before the first retry
+    retry_backoff_factor = 2        # the pause is multiplied with this after every retry
+    retry_backoff_max_us = 20000    # upper limit of the pause
     
 #-----------------------------------------------------------------------
 # constructor
+# zero_alloc: use the preallocated buffers and UART.readinto
+# so that register access does not allocate on the heap
+# exact_framing: wait for exactly the echo and reply bytes
+# instead of sleeping communication_pause
+# mtr_id, bus: address of the driver on a shared bus (see TMC_2209_bus)
 #-----------------------------------------------------------------------
-    def __init__(self, serialport, baudrate):
-        self.ser = UART(serialport, baudrate=115200, tx=6, rx=7) 
-        self.mtr_id=0
-        self.ser.init(115200 , bits=8, parity=None, stop=1)
+    def __init__(self, serialport, baudrate, zero_alloc=False, exact_framing=False, mtr_id=0, bus=None):
+        if bus is None:
+            self.ser = UART(serialport, baudrate=baudrate, tx=6, rx=7) 
+            self.ser.init(baudrate , bits=8, parity=None, stop=1)
+        else:
+            self.ser = bus.ser
+            self.bus = bus
+            self._owns_ser = False
+        self.mtr_id=mtr_id
         #self.ser.timeout = 20000/baudrate            # adjust per baud and hardware. Sequential reads without some delay fail.
         self.communication_pause = 500/baudrate     # adjust per baud and hardware. Sequential reads without some delay fail.
+        # wire time of 10 bits per byte. the TMC answers after SENDDELAY (8 bit times)
+        self._read_timeout_us = (12 * 10 + 8) * 1000000 // baudrate + self.reply_margin_us
+        self._write_timeout_us = (8 * 10) * 1000000 // baudrate + self.reply_margin_us
+
+        # every instance gets its own frames. ser.write takes them directly
+        self.rFrame = bytearray(self.rFrame)
+        self.wFrame = bytearray(self.wFrame)
+        # 4 bytes echo of the read request + 8 bytes reply
+        self.rxBuf = bytearray(12)
+        self._rxView = memoryview(self.rxBuf)
+        self._rxData = self._rxView[7:11]
+        self._rxEmpty = self._rxView[0:0]
+        # flushSerialBuffer drains into this, so rxBuf keeps the last reply
+        self._drainBuf = bytearray(16)
+        self.zero_alloc = zero_alloc
+        self.exact_framing = exact_framing
+        # the last reply frame (echo + reply) and its length for check_reply
+        self._reply = self.rxBuf
+        self._reply_len = 0
+        self.reset_error_counters()
 
         #self.ser.reset_output_buffer()
         #self.ser.reset_input_buffer()
@@ -39,70 +87,195 @@ class TMC_UART:
 # destructor
 #-----------------------------------------------------------------------
     def __del__(self):
-        self.ser.close()
+        if self._owns_ser:
+            self.ser.close()
 
 #-----------------------------------------------------------------------
 # this function calculates the crc8 parity bit
+# uses the lookup table from TMC_2209_crc
 #-----------------------------------------------------------------------
     def compute_crc8_atm(self, datagram, initial_value=0):
-        crc = initial_value
-        # Iterate bytes in data
-        for byte in datagram:
-            # Iterate bits in byte
-            for _ in range(0, 8):
-                if (crc >> 7) ^ (byte & 0x01):
-                    crc = ((crc << 1) ^ 0x07) & 0xFF
-                else:
-                    crc = (crc << 1) & 0xFF
-                # Shift to next bit
-                byte = byte >> 1
-        return crc
+        return crc8_atm(datagram, 0, len(datagram), initial_value)
     
 #-----------------------------------------------------------------------
 # reads the registry on the TMC with a given address.
 # returns the binary value of that register
+# on a shared bus, the bus is locked for the transaction
 #-----------------------------------------------------------------------
     def read_reg(self, reg):
+        telemetry = self.telemetry
+        if telemetry is not None:
+            start = time.ticks_us()
+        bus = self.bus
+        if bus is None:
+            rtn = self._read_reg(reg)
+        else:
+            bus.acquire()
+            try:
+                rtn = self._read_reg(reg)
+            finally:
+                bus.release()
+        if telemetry is not None:
+            telemetry.record(Op.read, reg, self._reply_len, start)
+        return rtn
+
+    def _read_reg(self, reg):
         
         rtn = ""
+        self._reply_len = 0
         #self.ser.reset_output_buffer()
         #self.ser.reset_input_buffer()
         
-        self.rFrame[1] = self.mtr_id
-        self.rFrame[2] = reg
-        self.rFrame[3] = self.compute_crc8_atm(self.rFrame[:-1])
+        self.build_read_frame(reg)
 
-        rt = self.ser.write(bytes(self.rFrame))
+        if self.exact_framing:
+            self.flushSerialBuffer()
+        rt = self.ser.write(self.rFrame)
         if rt != len(self.rFrame):
             print("TMC2209: Err in write {}".format(__), file=sys.stderr)
             return False
+        if self.exact_framing:
+            return self.read_reply_exact()
         time.sleep(self.communication_pause)  # adjust per baud and hardware. Sequential reads without some delay fail.
+        if self.zero_alloc:
+            return self.read_reply_into()
         if self.ser.any():
             rtn = self.ser.read()#read what it self 
         time.sleep(self.communication_pause)  # adjust per baud and hardware. Sequential reads without some delay fail.
         if rtn == None:
             print("TMC2209: Err in read")
             return ""
+        self._reply = rtn
+        self._reply_len = len(rtn)
 #         print("received "+str(len(rtn))+" bytes; "+str(len(rtn)*8)+" bits")
         return(rtn[7:11])
+
+#-----------------------------------------------------------------------
+# fills rFrame with the read request for reg
+#-----------------------------------------------------------------------
+    def build_read_frame(self, reg):
+        self.rFrame[1] = self.mtr_id
+        self.rFrame[2] = reg
+        self.rFrame[3] = crc8_atm(self.rFrame, 0, 3)
+
+#-----------------------------------------------------------------------
+# reads the reply of a read request into the preallocated rxBuf.
+# returns a memoryview on the 4 data bytes or an empty memoryview.
+# the returned view is only valid until the next register access
+#-----------------------------------------------------------------------
+    def read_reply_into(self):
+        n = 0
+        if self.ser.any():
+            n = self.ser.readinto(self.rxBuf)
+            # drop what does not fit into the frame, like read() would
+            self.flushSerialBuffer()
+        time.sleep(self.communication_pause)  # adjust per baud and hardware. Sequential reads without some delay fail.
+        if n is None or n < 11:
+            return self._rxEmpty
+        self._reply = self.rxBuf
+        self._reply_len = n
+        return self._rxData
+
+#-----------------------------------------------------------------------
+# waits until the 4 bytes echo and the 8 bytes reply are received
+# or the deadline computed from the baudrate is over.
+# returns a memoryview on the 4 data bytes or an empty memoryview
+#-----------------------------------------------------------------------
+    def read_reply_exact(self):
+        if not self.wait_rx(12, self._read_timeout_us):
+            # drop the partial reply, so the next request starts clean
+            self.flushSerialBuffer()
+            return self._rxEmpty
+        self.ser.readinto(self.rxBuf, 12)
+        self._reply = self.rxBuf
+        self._reply_len = 12
+        return self._rxData
+
+#-----------------------------------------------------------------------
+# busy waits until n bytes are in the receive buffer.
+# returns False if they did not arrive within timeout_us
+#-----------------------------------------------------------------------
+    def wait_rx(self, n, timeout_us):
+        start = time.ticks_us()
+        while self.ser.any() < n:
+            if time.ticks_diff(time.ticks_us(), start) > timeout_us:
+                return False
+        return True
+
+#-----------------------------------------------------------------------
+# checks the last reply frame of a read request of reg.
+# the reply starts after the 4 bytes echo:
+# sync, master address 0xFF, register, 4 data bytes, crc
+# returns a ReplyError value
+#-----------------------------------------------------------------------
+    def check_reply(self, reg):
+        frame = self._reply
+        if self._reply_len < 12:
+            return ReplyError.short
+        if (frame[4] & 0x0F) != 0x05:
+            return ReplyError.sync
+        if frame[5] != 0xFF:
+            return ReplyError.address
+        if frame[6] != reg:
+            return ReplyError.register
+        if not crc8_atm_check(frame, 4, 11):
+            return ReplyError.crc
+        return ReplyError.none
+
 #-----------------------------------------------------------------------
-# this function tries to read the registry of the TMC 10 times
-# if a valid answer is returned, this function returns it as an integer
+# this function tries to read the registry of the TMC
+# until a valid answer is returned or the retry policy gives up.
+# returns the answer as an integer, raises TMC_UART_Error otherwise
 #-----------------------------------------------------------------------
     def read_int(self, reg):
         tries = 0
+        backoff = self.retry_backoff_us
         while(True):
             rtn = self.read_reg(reg)
             tries += 1
-            if(len(rtn)>=4):
+            if(self.accept_reply(reg, tries)):
                 break
-            else:
-                print("TMC2209: did not get the expected 4 data bytes. Instead got "+str(len(rtn))+" Bytes")
-            if(tries>=10):
-                print("TMC2209: after 10 tries not valid answer. exiting")
-                print("TMC2209: is Stepper Powersupply switched on ?")
-                raise SystemExit
-        val = struct.unpack(">i",rtn)[0]
+            if(backoff > 0):
+                time.sleep_us(backoff)
+                backoff = min(backoff * self.retry_backoff_factor, self.retry_backoff_max_us)
+            self.flushSerialBuffer()
+        return self.decode_int(rtn)
+
+#-----------------------------------------------------------------------
+# validates and counts the reply of try number "tries".
+# returns True for a valid reply, False if it should be retried.
+# raises TMC_UART_Error when the retry policy gives up
+#-----------------------------------------------------------------------
+    def accept_reply(self, reg, tries):
+        err = self.check_reply(reg)
+        self.error_counters[err] += 1
+        telemetry = self.telemetry
+        if(err == ReplyError.none):
+            return True
+        if telemetry is not None:
+            telemetry.record_reply_error(reg, err)
+        if(tries>=self.retry_tries):
+            self.failures += 1
+            if telemetry is not None:
+                telemetry.record_failure(reg)
+            raise TMC_UART_Error(reg, err, tries)
+        self.retries += 1
+        if telemetry is not None:
+            telemetry.record_retry(reg)
+        return False
+
+#-----------------------------------------------------------------------
+# converts the 4 data bytes of a reply into a signed integer
+#-----------------------------------------------------------------------
+    def decode_int(self, rtn):
+        if self.zero_alloc:
+            # struct.unpack would allocate a tuple.
+            # values above 2^30 still become a long int on MicroPython
+            val = (rtn[0] << 24) | (rtn[1] << 16) | (rtn[2] << 8) | rtn[3]
+            if val & 0x80000000:
+                val -= 0x100000000
+        else:
+            val = struct.unpack(">i",rtn)[0]
         return(val)
 
 #-----------------------------------------------------------------------
@@ -112,10 +285,50 @@ class TMC_UART:
 # 3. write them back to the driver with this function
 #-----------------------------------------------------------------------
     def write_reg(self, reg, val):
+        telemetry = self.telemetry
+        if telemetry is not None:
+            start = time.ticks_us()
+        bus = self.bus
+        if bus is None:
+            rtn = self._write_reg(reg, val)
+        else:
+            bus.acquire()
+            try:
+                rtn = self._write_reg(reg, val)
+            finally:
+                bus.release()
+        if telemetry is not None:
+            telemetry.record(Op.write, reg, 8, start)
+        return rtn
+
+    def _write_reg(self, reg, val):
         
         #self.ser.reset_output_buffer()
         #self.ser.reset_input_buffer()
         
+        self.build_write_frame(reg, val)
+
+        if self.exact_framing:
+            self.flushSerialBuffer()
+        rtn = self.ser.write(self.wFrame)
+        if rtn != len(self.wFrame):
+            print("TMC2209: Err in write {}".format(__), file=sys.stderr)
+            return False
+        # the single wire bus echoes the write frame. consume it,
+        # otherwise the next read sees it in front of its reply
+        if self.exact_framing:
+            if self.wait_rx(8, self._write_timeout_us):
+                self.ser.readinto(self.rxBuf, 8)
+            return(True)
+        time.sleep(self.communication_pause)
+        self.flushSerialBuffer()
+
+        return(True)
+
+#-----------------------------------------------------------------------
+# fills wFrame with the write request of val to reg
+#-----------------------------------------------------------------------
+    def build_write_frame(self, reg, val):
         self.wFrame[1] = self.mtr_id
         self.wFrame[2] =  reg | 0x80;  # set write bit
         
@@ -124,30 +337,26 @@ class TMC_UART:
         self.wFrame[5] = 0xFF & (val>>8)
         self.wFrame[6] = 0xFF & val
         
-        self.wFrame[7] = self.compute_crc8_atm(self.wFrame[:-1])
-
-        rtn = self.ser.write(bytes(self.wFrame))
-        if rtn != len(self.wFrame):
-            print("TMC2209: Err in write {}".format(__), file=sys.stderr)
-            return False
-        time.sleep(self.communication_pause)
-
-        return(True)
+        self.wFrame[7] = crc8_atm(self.wFrame, 0, 7)
 
 #-----------------------------------------------------------------------
 # this function als writes a value to the register of the TMC
 # but it also checks if the writing process was successfully by checking
-# the InterfaceTransmissionCounter before and after writing
+# the InterfaceTransmissionCounter before and after writing.
+# inside of a batch (see begin_batch) the write is only queued for
+# the check in end_batch
 #-----------------------------------------------------------------------
     def write_reg_check(self, reg, val):
-        IFCNT           =   0x02
+        if self._batch is not None:
+            self.write_reg(reg, val)
+            self._batch.append((reg, val))
+            return True
 
         ifcnt1 = self.read_int(IFCNT)
         self.write_reg(reg, val)
         ifcnt2 = self.read_int(IFCNT)
-        ifcnt2 = self.read_int(IFCNT)
         
-        if(ifcnt1 >= ifcnt2):
+        if(((ifcnt2 - ifcnt1) & 0xFF) == 0):
             print("TMC2209: writing not successful!")
             print("reg:{} val:{}", reg, val)
             print("ifcnt:",ifcnt1,ifcnt2)
@@ -155,12 +364,144 @@ class TMC_UART:
         else:
             return True
 
+#-----------------------------------------------------------------------
+# starts a batch of verified writes.
+# IFCNT is read once here, the following write_reg_check calls
+# only write, and end_batch checks all of them with one IFCNT read.
+# batches can be nested, the outermost end_batch checks the writes.
+# every begin_batch needs its end_batch, also after an exception
+# (try/finally or TMC_2209.configBatch)
+#-----------------------------------------------------------------------
+    def begin_batch(self):
+        if self._batch_depth == 0:
+            self._batch_ifcnt = self.read_int(IFCNT)
+            self._batch = []
+        self._batch_depth += 1
+
+#-----------------------------------------------------------------------
+# ends the batch started with begin_batch.
+# if IFCNT did not count exactly one successful write per register,
+# every register of the batch is written again with write_reg_check.
+# returns whether all writes were successful, True for an inner batch
+#-----------------------------------------------------------------------
+    def end_batch(self):
+        if self._batch_depth > 1:
+            self._batch_depth -= 1
+            return True
+        self._batch_depth = 0
+        batch = self._batch
+        self._batch = None
+        if not batch:
+            return True
+        ifcnt = self.read_int(IFCNT)
+        if(((ifcnt - self._batch_ifcnt) & 0xFF) == (len(batch) & 0xFF)):
+            return True
+        print("TMC2209: batch write not verified. ifcnt:", self._batch_ifcnt, ifcnt, "writes:", len(batch))
+        ok = True
+        for reg, val in batch:
+            if not self.write_reg_check(reg, val):
+                ok = False
+        return ok
+
+#-----------------------------------------------------------------------
+# switches the zero allocation transport on or off
+#-----------------------------------------------------------------------
+    def set_zero_alloc(self, en):
+        self.zero_alloc = en
+
+#-----------------------------------------------------------------------
+# switches the exact reply framing on or off
+#-----------------------------------------------------------------------
+    def set_exact_framing(self, en):
+        self.exact_framing = en
+
+#-----------------------------------------------------------------------
+# sets how often read_int tries to read a register and how long
+# it pauses between the tries (in microseconds, growing by factor)
+#-----------------------------------------------------------------------
+    def set_retry_policy(self, tries=10, backoff_us=500, factor=2, max_backoff_us=20000):
+        self.retry_tries = max(tries, 1)
+        self.retry_backoff_us = backoff_us
+        self.retry_backoff_factor = factor
+        self.retry_backoff_max_us = max_backoff_us
+
+#-----------------------------------------------------------------------
+# returns the counters of the reply validation as dict:
+# ok, short, sync, address, register, crc: validated replies by result
+# retries: repeated reads, failures: read_int calls that gave up
+#-----------------------------------------------------------------------
+    def get_error_counters(self):
+        c = self.error_counters
+        return {"ok": c[ReplyError.none], "short": c[ReplyError.short],
+                "sync": c[ReplyError.sync], "address": c[ReplyError.address],
+                "register": c[ReplyError.register], "crc": c[ReplyError.crc],
+                "retries": self.retries, "failures": self.failures}
+
+#-----------------------------------------------------------------------
+# sets all counters of the reply validation to 0
+#-----------------------------------------------------------------------
+    def reset_error_counters(self):
+        self.error_counters = [0, 0, 0, 0, 0, 0]
+        self.retries = 0
+        self.failures = 0
+
+#-----------------------------------------------------------------------
+# switches the transaction telemetry on (see TMC_2209_telemetry)
+# a UartTelemetry can be shared by several TMC_UART
+#-----------------------------------------------------------------------
+    def enable_telemetry(self, telemetry=None):
+        if telemetry is None:
+            telemetry = UartTelemetry()
+        self.telemetry = telemetry
+        return telemetry
+
+#-----------------------------------------------------------------------
+# switches the transaction telemetry off
+#-----------------------------------------------------------------------
+    def disable_telemetry(self):
+        self.telemetry = None
+
+#-----------------------------------------------------------------------
+# returns the telemetry counters as dict, see UartTelemetry.snapshot.
+# returns None if the telemetry is not enabled
+#-----------------------------------------------------------------------
+    def telemetry_snapshot(self, reset=False):
+        if self.telemetry is None:
+            return None
+        return self.telemetry.snapshot(reset)
+
+#-----------------------------------------------------------------------
+# allocation counter to check the zero allocation transport.
+# reads the register count times with the GC disabled
+# and returns the heap bytes allocated per read.
+# if val is given, it is also written to the register every time.
+# returns None if gc.mem_alloc is not available (e.g. on the host)
+#-----------------------------------------------------------------------
+    def measure_alloc(self, reg=0x02, count=100, val=None):
+        if not hasattr(gc, "mem_alloc"):
+            return None
+        self.read_int(reg)              # warm up
+        gc.collect()
+        gc.disable()
+        try:
+            before = gc.mem_alloc()
+            for _ in range(count):
+                if val is not None:
+                    self.write_reg(reg, val)
+                self.read_int(reg)
+            after = gc.mem_alloc()
+        finally:
+            gc.enable()
+        return (after - before) // count
+
 #-----------------------------------------------------------------------
 # this function clear the communication buffers of the Raspberry Pi
 #-----------------------------------------------------------------------
     def flushSerialBuffer(self):
         #self.ser.reset_output_buffer()
         #self.ser.reset_input_buffer()
+        while self.ser.any():
+            self.ser.readinto(self._drainBuf)
         return
 
 #-----------------------------------------------------------------------
@@ -0,0 +1,213 @@
+from .TMC_2209_uart import TMC_UART, IFCNT
+from .TMC_2209_telemetry import Op
+import time
+import gc
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+#-----------------------------------------------------------------------
+# TMC_UART_Async
+#
+# uasyncio variant of TMC_UART.
+# frames, CRC, reply validation, retry policy and the error counters
+# are the ones of TMC_UART, but all register accesses are coroutines:
+#
+#   tmc = TMC_UART_Async(2, 115200)
+#   sg_result = await tmc.read_int(0x41)
+#
+# while the bytes are on the wire, other coroutines keep running.
+# the UART is owned by this object and accessed through
+# StreamReader/StreamWriter. an asyncio.Lock keeps the frames of
+# concurrent coroutines apart. write_reg_check holds it from the first
+# IFCNT read to the second. the helpers of TMC_UART that access
+# registers (write_reg_check, the batch, measure_alloc) are
+# coroutines here too.
+# TMC_2209 uses the blocking calls, so this transport is meant to be
+# used directly from coroutines, like telemetry or stall polling
+#-----------------------------------------------------------------------
+class TMC_UART_Async(TMC_UART):
+
+#-----------------------------------------------------------------------
+# constructor
+#-----------------------------------------------------------------------
+    def __init__(self, serialport, baudrate, mtr_id=0):
+        super().__init__(serialport, baudrate, exact_framing=True, mtr_id=mtr_id)
+        self._sreader = asyncio.StreamReader(self.ser)
+        self._swriter = asyncio.StreamWriter(self.ser, {})
+        self._alock = asyncio.Lock()
+        self._read_timeout_s = self._read_timeout_us / 1000000
+        self._write_timeout_s = self._write_timeout_us / 1000000
+
+#-----------------------------------------------------------------------
+# sends a frame and waits for n received bytes (echo + reply).
+# returns the received bytes or None after the timeout
+#-----------------------------------------------------------------------
+    async def _transfer(self, frame, n, timeout_s):
+        self.flushSerialBuffer()
+        self._swriter.write(frame)
+        await self._swriter.drain()
+        try:
+            return await asyncio.wait_for(self._sreader.readexactly(n), timeout_s)
+        except asyncio.TimeoutError:
+            # drop the partial reply, so the next request starts clean
+            self.flushSerialBuffer()
+            return None
+
+#-----------------------------------------------------------------------
+# reads the registry on the TMC with a given address.
+# returns a memoryview on the 4 data bytes or an empty memoryview
+#-----------------------------------------------------------------------
+    async def read_reg(self, reg):
+        async with self._alock:
+            return await self._read_reg(reg)
+
+#-----------------------------------------------------------------------
+# read_reg without the lock. should not be called from outside!
+#-----------------------------------------------------------------------
+    async def _read_reg(self, reg):
+        start = time.ticks_us()
+        self._reply_len = 0
+        self.build_read_frame(reg)
+        data = await self._transfer(self.rFrame, 12, self._read_timeout_s)
+        if data is not None:
+            self.rxBuf[0:12] = data
+            self._reply = self.rxBuf
+            self._reply_len = 12
+        if self.telemetry is not None:
+            self.telemetry.record(Op.read, reg, self._reply_len, start)
+        if data is None:
+            return self._rxEmpty
+        return self._rxData
+
+#-----------------------------------------------------------------------
+# reads a register with the retry policy of TMC_UART.
+# the lock is held for all tries.
+# returns the value as integer, raises TMC_UART_Error otherwise
+#-----------------------------------------------------------------------
+    async def read_int(self, reg):
+        async with self._alock:
+            return await self._read_int(reg)
+
+#-----------------------------------------------------------------------
+# read_int without the lock. should not be called from outside!
+#-----------------------------------------------------------------------
+    async def _read_int(self, reg):
+        tries = 0
+        backoff = self.retry_backoff_us
+        while(True):
+            rtn = await self._read_reg(reg)
+            tries += 1
+            if(self.accept_reply(reg, tries)):
+                break
+            if(backoff > 0):
+                # asyncio.sleep takes seconds in uasyncio and in CPython
+                await asyncio.sleep(backoff / 1000000)
+                backoff = min(backoff * self.retry_backoff_factor, self.retry_backoff_max_us)
+            self.flushSerialBuffer()
+        return self.decode_int(rtn)
+
+#-----------------------------------------------------------------------
+# writes a value to a register of the TMC.
+# the echo of the write frame is consumed
+#-----------------------------------------------------------------------
+    async def write_reg(self, reg, val):
+        async with self._alock:
+            return await self._write_reg(reg, val)
+
+#-----------------------------------------------------------------------
+# write_reg without the lock. should not be called from outside!
+#-----------------------------------------------------------------------
+    async def _write_reg(self, reg, val):
+        start = time.ticks_us()
+        self.build_write_frame(reg, val)
+        await self._transfer(self.wFrame, 8, self._write_timeout_s)
+        if self.telemetry is not None:
+            self.telemetry.record(Op.write, reg, 8, start)
+        return(True)
+
+#-----------------------------------------------------------------------
+# writes a value and checks it with the InterfaceTransmissionCounter.
+# the lock is held from the first IFCNT read to the second, so no
+# other coroutine can write in between.
+# inside of a batch, the write is only queued for end_batch
+#-----------------------------------------------------------------------
+    async def write_reg_check(self, reg, val):
+        async with self._alock:
+            return await self._write_reg_check(reg, val)
+
+#-----------------------------------------------------------------------
+# write_reg_check without the lock. should not be called from outside!
+#-----------------------------------------------------------------------
+    async def _write_reg_check(self, reg, val):
+        if self._batch is not None:
+            await self._write_reg(reg, val)
+            self._batch.append((reg, val))
+            return True
+
+        ifcnt1 = await self._read_int(IFCNT)
+        await self._write_reg(reg, val)
+        ifcnt2 = await self._read_int(IFCNT)
+
+        if(((ifcnt2 - ifcnt1) & 0xFF) == 0):
+            print("TMC2209: writing not successful!")
+            print("reg:{} val:{}", reg, val)
+            print("ifcnt:",ifcnt1,ifcnt2)
+            return False
+        else:
+            return True
+
+#-----------------------------------------------------------------------
+# starts a batch of verified writes, see TMC_UART.begin_batch
+#-----------------------------------------------------------------------
+    async def begin_batch(self):
+        async with self._alock:
+            if self._batch_depth == 0:
+                self._batch_ifcnt = await self._read_int(IFCNT)
+                self._batch = []
+            self._batch_depth += 1
+
+#-----------------------------------------------------------------------
+# ends the batch, see TMC_UART.end_batch
+#-----------------------------------------------------------------------
+    async def end_batch(self):
+        async with self._alock:
+            if self._batch_depth > 1:
+                self._batch_depth -= 1
+                return True
+            self._batch_depth = 0
+            batch = self._batch
+            self._batch = None
+            if not batch:
+                return True
+            ifcnt = await self._read_int(IFCNT)
+            if(((ifcnt - self._batch_ifcnt) & 0xFF) == (len(batch) & 0xFF)):
+                return True
+            print("TMC2209: batch write not verified. ifcnt:", self._batch_ifcnt, ifcnt, "writes:", len(batch))
+            ok = True
+            for reg, val in batch:
+                if not await self._write_reg_check(reg, val):
+                    ok = False
+            return ok
+
+#-----------------------------------------------------------------------
+# allocation counter, see TMC_UART.measure_alloc.
+# allocations of other coroutines that run meanwhile are counted too
+#-----------------------------------------------------------------------
+    async def measure_alloc(self, reg=0x02, count=100, val=None):
+        if not hasattr(gc, "mem_alloc"):
+            return None
+        await self.read_int(reg)        # warm up
+        gc.collect()
+        gc.disable()
+        try:
+            before = gc.mem_alloc()
+            for _ in range(count):
+                if val is not None:
+                    await self.write_reg(reg, val)
+                await self.read_int(reg)
+            after = gc.mem_alloc()
+        finally:
+            gc.enable()
+        return (after - before) // count